@@ -1,11 +1,2116 @@
 import tkinter as tk
-from tkinter import font, messagebox, ttk
+from tkinter import font, messagebox, simpledialog, ttk
 import json
 import os
 import time
-from pygame import mixer
+# pygame prints a banner on import, which would corrupt --batch and --analytics output
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+try:
+    from pygame import mixer
+except ImportError:  # Sound is optional
+    mixer = None
 from typing import List, Optional, Dict, Tuple, Union
 import random
+import math
+import mmap
+import struct
+import argparse
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import lru_cache
+import queue
+import threading
+import collections
+import shlex
+import subprocess
+import sys
+import multiprocessing
+
+
+WIN_PATTERNS = [
+    [0, 1, 2], [3, 4, 5], [6, 7, 8],  # rows
+    [0, 3, 6], [1, 4, 7], [2, 5, 8],  # columns
+    [0, 4, 8], [2, 4, 6]               # diagonals
+]
+
+# Hard upper bound on how long any AI move may take (seconds)
+AI_MAX_RESPONSE_TIME = 1.0
+
+# Every difficulty is the same search with a different budget:
+# a node cap, a time budget (seconds) and a move-selection temperature.
+AI_LEVELS = {
+    'easy': {'max_nodes': 25, 'time_budget': 0.05, 'temperature': 6.0},
+    'medium': {'max_nodes': 250, 'time_budget': 0.1, 'temperature': 2.0},
+    'hard': {'max_nodes': 2500, 'time_budget': 0.25, 'temperature': 0.5},
+    'unbeatable': {'max_nodes': None, 'time_budget': 1.0, 'temperature': 0.0}
+}
+
+WIN_SCORE = 100
+
+
+_LINES_THROUGH_CACHE: Dict[int, Tuple[List[List[int]], List[List[List[int]]]]] = {}
+
+
+def _lines_through(lines: List[List[int]]) -> List[List[List[int]]]:
+    """Lines passing through each cell, computed once per line list."""
+    cached = _LINES_THROUGH_CACHE.get(id(lines))
+    if cached is None or cached[0] is not lines:
+        table = [[] for _ in range(max(max(line) for line in lines) + 1)]
+        for line in lines:
+            for i in line:
+                table[i].append(line)
+        cached = _LINES_THROUGH_CACHE[id(lines)] = (lines, table)
+    return cached[1]
+
+
+LINES_THROUGH = _lines_through(WIN_PATTERNS)
+
+
+def _line_numbers_through(lines: List[List[int]]) -> List[List[int]]:
+    """Positions in lines of the lines passing through each cell."""
+    table = [[] for _ in range(max(max(line) for line in lines) + 1)]
+    for n, line in enumerate(lines):
+        for i in line:
+            table[i].append(n)
+    return table
+
+
+def completes_line(
+    cells,
+    index: int,
+    symbol: str,
+    lines_through: List[List[List[int]]] = LINES_THROUGH
+) -> bool:
+    """Check whether symbol at index completes one of the lines through that cell."""
+    return any(all(cells[i] == symbol for i in line) for line in lines_through[index])
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when its node or time budget is spent."""
+
+
+class MoveSearch:
+    """Iterative-deepening alpha-beta search bounded by nodes and time."""
+    
+    default_lines = WIN_PATTERNS
+    response_time = AI_MAX_RESPONSE_TIME
+    win_score = WIN_SCORE
+    # Worker processes for root-split search; 0 or 1 searches serially
+    parallel_workers = 0
+    # Whether this search can be split across the pool at all
+    split_root = True
+
+    def __init__(
+        self,
+        max_nodes: Optional[int] = None,
+        time_budget: float = AI_MAX_RESPONSE_TIME,
+        temperature: float = 0.0,
+        lines: Optional[List[List[int]]] = None
+    ):
+        lines = lines or self.default_lines
+        self.max_nodes = max_nodes
+        self.time_budget = min(time_budget, self.response_time)
+        self.temperature = temperature
+        self.lines_through = _lines_through(lines)
+        self.nodes = 0
+        self.depth = 0
+        self.scores: Dict[int, int] = {}
+        self.deadline = 0.0
+
+    @classmethod
+    def for_level(cls, difficulty: str, lines: Optional[List[List[int]]] = None) -> "MoveSearch":
+        """Build a search configured for one of the AI_LEVELS."""
+        level = AI_LEVELS.get(difficulty, AI_LEVELS['medium'])
+        return cls(level['max_nodes'], level['time_budget'], level['temperature'], lines)
+
+    def is_win(self, board: List[str], index: int, symbol: str) -> bool:
+        """Check whether the move just played at index completed a line."""
+        return completes_line(board, index, symbol, self.lines_through)
+
+    def choose_move(self, board: List[str], symbol: str, opponent: str) -> int:
+        """Search the position and pick a move, best-so-far on timeout."""
+        scores = self.search(board, symbol, opponent)
+        return self.select(scores)
+
+    def search(self, board: List[str], symbol: str, opponent: str, *extra) -> Dict[int, int]:
+        """Score every legal move for symbol within the configured budget."""
+        self.nodes = 0
+        self.depth = 0
+        self.deadline = time.perf_counter() + self.time_budget
+        self.scores = {}
+        self.prepare(board, symbol, opponent, *extra)
+        moves = self.root_moves()
+        if self.scores:
+            return self.scores  # Decided without searching
+        # Exact scores for every root move are only needed to sample by temperature
+        exact = self.temperature > 0
+        # Node-capped levels stay serial: a node budget split across processes is not the same search
+        split = (
+            self.split_root and self.parallel_workers > 1 and self.max_nodes is None
+            and len(moves) > 1 and _SEARCH_POOL_LOCK.acquire(blocking=False)
+        )
+        task = (type(self), list(board), symbol, opponent, extra)
+        
+        try:
+            for depth in range(1, board.count("") + 1):
+                partial: Dict[int, int] = {}
+                try:
+                    if split:
+                        self.split_iteration(task, moves, depth, exact, partial)
+                    else:
+                        self.serial_iteration(moves, depth, exact, partial)
+                except SearchTimeout:
+                    if not self.scores:
+                        # Nothing finished yet: use what this iteration found
+                        self.scores = {i: partial.get(i, 0) for i in moves}
+                    break
+                
+                self.scores = partial
+                self.depth = depth
+                # Search the best move first next iteration and keep the rest in order,
+                # so serial and parallel searches visit moves alike
+                best = max(partial, key=partial.get)
+                moves.remove(best)
+                moves.insert(0, best)
+                if abs(partial[best]) >= self.win_score - len(board):
+                    break  # Forced result found, deeper search cannot change it
+        finally:
+            if split:
+                _SEARCH_POOL_LOCK.release()
+        
+        return self.scores
+
+    def prepare(self, board: List[str], symbol: str, opponent: str):
+        """Set up the root position to search."""
+        self.board = list(board)
+        self.symbol = symbol
+        self.opponent = opponent
+
+    def root_moves(self) -> List[int]:
+        """Root moves in search order; setting scores instead decides the move outright."""
+        return [i for i, cell in enumerate(self.board) if cell == ""]
+
+    def score_move(self, move: int, depth: int, lower: float) -> float:
+        """Score one root move to depth; exact when above lower, else an upper bound."""
+        board = self.board
+        board[move] = self.symbol
+        if self.is_win(board, move, self.symbol):
+            score = WIN_SCORE - 1
+        else:
+            score = -self.negamax(board, self.opponent, self.symbol, depth - 1, -float('inf'), -lower, 2)
+        board[move] = ""
+        return score
+
+    def serial_iteration(self, moves: List[int], depth: int, exact: bool, partial: Dict[int, int]):
+        """One iteration over the root moves in order, scores into partial."""
+        alpha = -float('inf')
+        for i in moves:
+            score = self.score_move(i, depth, -float('inf') if exact else alpha)
+            partial[i] = score
+            alpha = max(alpha, score)
+
+    def split_iteration(
+        self,
+        task: tuple,
+        moves: List[int],
+        depth: int,
+        exact: bool,
+        partial: Dict[int, int]
+    ):
+        """One iteration with the root moves spread across the search pool.
+        
+        Young brothers wait: the first move is searched here and sets the
+        shared alpha, then the rest run in parallel against it. Results are
+        gathered in move order so the scores match a serial iteration's.
+        """
+        pool, alpha, setter = search_pool(self.parallel_workers)
+        first = moves[0]
+        partial[first] = self.score_move(first, depth, -float('inf'))
+        with alpha.get_lock():
+            alpha.value, setter.value = partial[first], 0
+        
+        deadline = time.time() + self.deadline - time.perf_counter()
+        futures = [
+            pool.submit(_search_root_move, task + (i, order, depth, exact, deadline))
+            for order, i in enumerate(moves[1:], 1)
+        ]
+        _, pending = wait(futures, timeout=max(0.0, self.deadline - time.perf_counter()))
+        timed_out = bool(pending)
+        for i, future in zip(moves[1:], futures):
+            if future in pending:
+                # Not started yet, or still running; it stops at its own deadline
+                future.cancel()
+                continue
+            score, nodes = future.result()
+            self.nodes += nodes
+            if score is None:
+                timed_out = True
+            elif not timed_out:
+                partial[i] = score
+        if timed_out:
+            raise SearchTimeout()
+
+    def negamax(
+        self,
+        board: List[str],
+        symbol: str,
+        opponent: str,
+        depth: int,
+        alpha: float,
+        beta: float,
+        ply: int
+    ) -> float:
+        """Score the position for symbol, the side to move."""
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SearchTimeout()
+        if self.nodes % 64 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        
+        moves = [i for i, cell in enumerate(board) if cell == ""]
+        if not moves or depth == 0:
+            return 0  # Draw or search horizon
+        
+        best = -float('inf')
+        for i in moves:
+            board[i] = symbol
+            if self.is_win(board, i, symbol):
+                score = WIN_SCORE - ply
+            else:
+                score = -self.negamax(board, opponent, symbol, depth - 1, -beta, -alpha, ply + 1)
+            board[i] = ""
+            
+            if score > best:
+                best = score
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
+        return best
+
+    def select(self, scores: Dict[int, int]) -> int:
+        """Pick a move from root scores, sampling by temperature."""
+        best_score = max(scores.values())
+        if self.temperature <= 0:
+            return next(i for i, score in scores.items() if score == best_score)
+        
+        moves = list(scores)
+        weights = [math.exp((scores[i] - best_score) / self.temperature) for i in moves]
+        return random.choices(moves, weights=weights)[0]
+
+
+# Root-split search pool: (executor, shared alpha, order of the move that set it)
+_SEARCH_POOL: Optional[tuple] = None
+_SEARCH_POOL_LOCK = threading.Lock()
+_SHARED_ALPHA = None
+
+
+def _init_search_worker(alpha, setter):
+    """Pool initializer: keep the shared alpha for _search_root_move."""
+    global _SHARED_ALPHA
+    _SHARED_ALPHA = (alpha, setter)
+
+
+def search_pool(workers: int) -> tuple:
+    """The persistent root-split pool, started on first use."""
+    global _SEARCH_POOL
+    if _SEARCH_POOL is None:
+        alpha = multiprocessing.Value('d', -float('inf'))
+        setter = multiprocessing.Value('i', 0, lock=False)
+        executor = ProcessPoolExecutor(workers, initializer=_init_search_worker, initargs=(alpha, setter))
+        # Start every worker now rather than during the first move's deadline
+        for future in [executor.submit(int) for _ in range(workers)]:
+            future.result()
+        _SEARCH_POOL = (executor, alpha, setter)
+    return _SEARCH_POOL
+
+
+def shutdown_search_pool():
+    """Stop the root-split pool's worker processes."""
+    global _SEARCH_POOL
+    if _SEARCH_POOL is not None:
+        _SEARCH_POOL[0].shutdown()
+        _SEARCH_POOL = None
+
+
+def _search_root_move(task: tuple) -> Tuple[Optional[float], int]:
+    """Search one root move against the shared alpha: (score or None on timeout, nodes)."""
+    search_class, board, symbol, opponent, extra, move, order, depth, exact, deadline = task
+    search = search_class()
+    search.prepare(board, symbol, opponent, *extra)
+    search.deadline = time.perf_counter() + deadline - time.time()
+    
+    lower = -float('inf')
+    if not exact:
+        alpha, setter = _SHARED_ALPHA
+        with alpha.get_lock():
+            shared, shared_order = alpha.value, setter.value
+        # Ties go to the earlier move, as in the serial search, so a move ahead of
+        # the one that set alpha must prove it reaches alpha (scores are integers)
+        lower = shared if shared_order < order else shared - 1
+    try:
+        score = search.score_move(move, depth, lower)
+    except SearchTimeout:
+        return None, search.nodes
+    
+    # A result after the deadline belongs to a search that has already moved on
+    if not exact and time.perf_counter() <= search.deadline:
+        with alpha.get_lock():
+            if score > alpha.value or (score == alpha.value and order < setter.value):
+                alpha.value, setter.value = score, order
+    return score, search.nodes
+
+
+def _build_symmetries(size: int = 3) -> List[List[int]]:
+    """All 8 symmetries of a square board as permutations (transformed[j] = board[perm[j]])."""
+    rotate = [(size - 1 - j % size) * size + j // size for j in range(size * size)]
+    reflect = [(j // size) * size + size - 1 - j % size for j in range(size * size)]
+    perms = [list(range(size * size))]
+    for perm in perms:
+        for step in (rotate, reflect):
+            composed = [perm[j] for j in step]
+            if composed not in perms:
+                perms.append(composed)
+    return perms
+
+
+SYMMETRIES = _build_symmetries()
+CELL_CODES = {"": 0, "X": 1, "O": 2}
+
+
+def canonical_position(
+    board: List[str],
+    symmetries: List[List[int]] = SYMMETRIES
+) -> Tuple[int, List[int]]:
+    """Return the smallest base-3 code over all symmetries and its permutation."""
+    best_code, best_perm = None, None
+    for perm in symmetries:
+        code = 0
+        for j in range(len(board) - 1, -1, -1):
+            code = code * 3 + CELL_CODES[board[perm[j]]]
+        if best_code is None or code < best_code:
+            best_code, best_perm = code, perm
+    return best_code, best_perm
+
+
+def _outcome_key(result: Tuple[int, int]) -> Tuple[int, int]:
+    """Sort key for (value, distance) outcomes: win fast, lose slow."""
+    return (result[0], -result[1] if result[0] >= 0 else result[1])
+
+
+def move_outcomes(cells: Tuple[str, ...], symbol: str) -> Dict[int, Tuple[int, int]]:
+    """Exact value and plies to the end of each move for symbol."""
+    opponent = "O" if symbol == "X" else "X"
+    outcomes = {}
+    for i, cell in enumerate(cells):
+        if cell != "":
+            continue
+        child = cells[:i] + (symbol,) + cells[i + 1:]
+        if completes_line(child, i, symbol):
+            outcomes[i] = (1, 1)
+        elif "" not in child:
+            outcomes[i] = (0, 1)
+        else:
+            value, distance = solve_position(child, opponent)
+            outcomes[i] = (-value, distance + 1)
+    return outcomes
+
+
+@lru_cache(maxsize=None)
+def solve_position(cells: Tuple[str, ...], symbol: str) -> Tuple[int, int]:
+    """Exact value (1 win, 0 draw, -1 loss) and plies to the end for symbol to move."""
+    return max(move_outcomes(cells, symbol).values(), key=_outcome_key)
+
+
+POLICY_FILE = "tictactoe_policy.bin"
+POLICY_MAGIC = b"TTTQ"
+POLICY_HEADER = struct.Struct("<4sIQ")  # magic, version, episodes trained
+POLICY_VERSION = 2
+
+
+@lru_cache(maxsize=None)
+def policy_rows() -> Dict[int, int]:
+    """Row of every canonical position with a move to make, in order of its code."""
+    codes, stack = set(), [0]
+    while stack:
+        code = stack.pop()
+        cells = decode_position(code, 9)
+        if code in codes or _game_result(cells) is not None:
+            continue
+        codes.add(code)
+        symbol = "X" if cells.count("X") == cells.count("O") else "O"
+        for i, cell in enumerate(cells):
+            if cell == "":
+                cells[i] = symbol
+                stack.append(canonical_position(cells)[0])
+                cells[i] = ""
+    return {code: row for row, code in enumerate(sorted(codes))}
+
+
+def _self_play_batch(task: Tuple[bytes, int, float, int]) -> Dict[int, List[float]]:
+    """Play a batch of epsilon-greedy self-play games and total the returns per (state, action)."""
+    table_bytes, episodes, epsilon, seed = task
+    table = array('f')
+    table.frombytes(table_bytes)
+    rng = random.Random(seed)
+    rows = policy_rows()
+    returns: Dict[int, List[float]] = {}
+    
+    for _ in range(episodes):
+        board = [""] * 9
+        history = {"X": [], "O": []}
+        symbol, winner = "X", None
+        while True:
+            code, perm = canonical_position(board)
+            row = rows[code] * 9
+            legal = [j for j in range(9) if board[perm[j]] == ""]
+            rng.shuffle(legal)  # Random tie-breaking
+            if rng.random() < epsilon:
+                action = legal[0]
+            else:
+                action = max(legal, key=lambda j: table[row + j])
+            history[symbol].append(row + action)
+            
+            cell = perm[action]
+            board[cell] = symbol
+            if completes_line(board, cell, symbol):
+                winner = symbol
+                break
+            if "" not in board:
+                break
+            symbol = "O" if symbol == "X" else "X"
+        
+        for player, keys in history.items():
+            reward = 0 if winner is None else (1 if winner == player else -1)
+            for key in keys:
+                total = returns.setdefault(key, [0.0, 0])
+                total[0] += reward
+                total[1] += 1
+    return returns
+
+
+def policy_agreement(table) -> float:
+    """Fraction of canonical positions where the greedy policy move is minimax-optimal."""
+    seen, agree = set(), 0
+    stack = [([""] * 9, "X")]
+    while stack:
+        board, symbol = stack.pop()
+        code, perm = canonical_position(board)
+        if code in seen:
+            continue
+        seen.add(code)
+        
+        opponent = "O" if symbol == "X" else "X"
+        legal = [j for j in range(9) if board[perm[j]] == ""]
+        best_value = solve_position(tuple(board), symbol)[0]
+        row = policy_rows()[code] * 9
+        greedy = max(legal, key=lambda j: table[row + j])
+        outcomes = {}
+        for j in legal:
+            child = list(board)
+            child[perm[j]] = symbol
+            if completes_line(child, perm[j], symbol):
+                outcomes[j] = 1
+            elif "" not in child:
+                outcomes[j] = 0
+            else:
+                outcomes[j] = -solve_position(tuple(child), opponent)[0]
+                stack.append((child, opponent))
+        agree += outcomes[greedy] == best_value
+    return agree / len(seen)
+
+
+def write_policy(path: str, table: array, episodes: int):
+    """Write the greedy move of each Q table row: a header, then one byte per row."""
+    moves = bytearray()
+    for code, row in policy_rows().items():
+        cells = decode_position(code, 9)
+        legal = [j for j in range(9) if cells[j] == ""]
+        moves.append(max(legal, key=lambda j: table[row * 9 + j]))
+    with open(path, 'wb') as f:
+        f.write(POLICY_HEADER.pack(POLICY_MAGIC, POLICY_VERSION, episodes))
+        f.write(moves)
+
+
+def train_policy(
+    episodes: int,
+    path: str = POLICY_FILE,
+    workers: Optional[int] = None,
+    batch_size: int = 500,
+    checkpoint_every: Optional[int] = None,
+    learning_rate: float = 0.2
+):
+    """Train the tabular policy by parallel self-play and save checkpoints."""
+    workers = workers or os.cpu_count() or 1
+    checkpoint_every = checkpoint_every or max(episodes // 5, 1)
+    table = array('f', [0.0]) * (len(policy_rows()) * 9)
+    stem, ext = os.path.splitext(path)
+    played, next_checkpoint = 0, checkpoint_every
+    start = time.perf_counter()
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while played < episodes:
+            # Explore a lot early on, then settle towards the greedy policy
+            epsilon = max(0.05, 0.5 * (1 - played / episodes))
+            table_bytes = table.tobytes()
+            sizes = []
+            # Stop the round at the next checkpoint so checkpoints land exactly on it
+            remaining = min(episodes, next_checkpoint) - played
+            for _ in range(workers):
+                size = min(batch_size, remaining)
+                if size <= 0:
+                    break
+                sizes.append(size)
+                remaining -= size
+            tasks = [(table_bytes, size, epsilon, random.getrandbits(32)) for size in sizes]
+            
+            for returns in pool.map(_self_play_batch, tasks):
+                for key, (total, count) in returns.items():
+                    step = min(1.0, learning_rate * count)
+                    table[key] += step * (total / count - table[key])
+            played += sum(sizes)
+            
+            if played >= next_checkpoint or played >= episodes:
+                rate = played / (time.perf_counter() - start)
+                agreement = policy_agreement(table)
+                checkpoint = f"{stem}_{played}{ext}"
+                write_policy(checkpoint, table, played)
+                print(f"{played} episodes  {rate:.0f} episodes/s  "
+                      f"minimax agreement {agreement:.1%}  -> {checkpoint}")
+                next_checkpoint += checkpoint_every
+    
+    write_policy(path, table, played)
+    print(f"Saved policy to {path}")
+
+
+class QPolicy:
+    """Trained policy moves, memory-mapped from disk."""
+    
+    def __init__(self, path: str = POLICY_FILE):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) != POLICY_HEADER.size + len(policy_rows()):
+            raise ValueError(f"{path} is not a policy file")
+        magic, version, self.episodes = POLICY_HEADER.unpack_from(self.mmap)
+        if magic != POLICY_MAGIC or version != POLICY_VERSION:
+            raise ValueError(f"{path} is not a policy file")
+        self.moves = memoryview(self.mmap)[POLICY_HEADER.size:]
+    
+    def best_move(self, board: List[str]) -> int:
+        """Look up the trained move for the position."""
+        code, perm = canonical_position(board)
+        return perm[self.moves[policy_rows()[code]]]
+
+
+def _build_grid_lines(size: int, k: int) -> List[List[int]]:
+    """Every run of k cells along rows, columns and diagonals of a size x size board."""
+    lines = []
+    for dy, dx in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        for y in range(size):
+            for x in range(size):
+                cells = [(y + n * dy, x + n * dx) for n in range(k)]
+                if all(0 <= cy < size and 0 <= cx < size for cy, cx in cells):
+                    lines.append([cy * size + cx for cy, cx in cells])
+    return lines
+
+
+# Puzzle boards: name -> (board size, stones in a row to win)
+PUZZLE_BOARDS = {
+    "3x3": (3, 3),
+    "4x4": (4, 4)
+}
+PUZZLE_LINES_THROUGH = {
+    name: _lines_through(_build_grid_lines(size, k)) for name, (size, k) in PUZZLE_BOARDS.items()
+}
+PUZZLE_SYMMETRIES = {name: _build_symmetries(size) for name, (size, _) in PUZZLE_BOARDS.items()}
+PUZZLE_FILE = "tictactoe_puzzles.bin"
+PUZZLE_MAGIC = b"TTTP"
+PUZZLE_HEADER = struct.Struct("<4sBB")  # magic, board size, stones in a row
+PUZZLE_RECORD = struct.Struct("<QBB")   # position code, moves to win, solution cell
+PUZZLE_CHUNK = 2000
+
+
+def decode_position(code: int, cell_count: int) -> List[str]:
+    """Turn a base-3 position code back into a list of cells."""
+    symbols = ["", "X", "O"]
+    cells = []
+    for _ in range(cell_count):
+        code, digit = divmod(code, 3)
+        cells.append(symbols[digit])
+    return cells
+
+
+def _move_wins_within(config: str, cells: Tuple[str, ...], index: int, symbol: str, n: int) -> bool:
+    """Whether playing index forces a win for symbol within n of its own moves."""
+    lines_through = PUZZLE_LINES_THROUGH[config]
+    child = cells[:index] + (symbol,) + cells[index + 1:]
+    if completes_line(child, index, symbol, lines_through):
+        return True
+    if n == 1 or "" not in child:
+        return False
+    
+    opponent = "O" if symbol == "X" else "X"
+    for reply, cell in enumerate(child):
+        if cell != "":
+            continue
+        grandchild = child[:reply] + (opponent,) + child[reply + 1:]
+        if completes_line(grandchild, reply, opponent, lines_through) or "" not in grandchild:
+            return False
+        if not _forces_win(config, grandchild, symbol, n - 1):
+            return False
+    return True
+
+
+@lru_cache(maxsize=1 << 20)
+def _forces_win(config: str, cells: Tuple[str, ...], symbol: str, n: int) -> bool:
+    """Whether symbol, to move, can force a win within n of its own moves."""
+    return any(
+        _move_wins_within(config, cells, i, symbol, n)
+        for i, cell in enumerate(cells) if cell == ""
+    )
+
+
+def _mine_puzzle_chunk(task: Tuple[str, List[int], List[int]]) -> Tuple[List[Tuple[int, int, int]], List[int]]:
+    """Find puzzles among a chunk of canonical positions and expand their children.
+    
+    Returns (code, moves to win, solution cell) records and the canonical
+    codes of every position one move deeper.
+    """
+    config, codes, moves = task
+    cell_count = PUZZLE_BOARDS[config][0] ** 2
+    symmetries = PUZZLE_SYMMETRIES[config]
+    lines_through = PUZZLE_LINES_THROUGH[config]
+    puzzles, children = [], set()
+    
+    for code in codes:
+        cells = tuple(decode_position(code, cell_count))
+        symbol = "X" if cells.count("X") == cells.count("O") else "O"
+        previous = "O" if symbol == "X" else "X"
+        if any(cell == previous and completes_line(cells, i, previous, lines_through) for i, cell in enumerate(cells)):
+            continue  # Game already over
+        
+        empty = [i for i, cell in enumerate(cells) if cell == ""]
+        for i in empty:
+            child = list(cells)
+            child[i] = symbol
+            children.add(canonical_position(child, symmetries)[0])
+        
+        # Shortest forced win, if it is one of the requested lengths
+        shortest = next((n for n in range(1, max(moves) + 1) if _forces_win(config, cells, symbol, n)), None)
+        if shortest in moves:
+            winners = [i for i in empty if _move_wins_within(config, cells, i, symbol, shortest)]
+            if len(winners) == 1:
+                puzzles.append((code, shortest, winners[0]))
+    
+    return puzzles, sorted(children)
+
+
+def _read_codes(path: str) -> array:
+    """Read a file of 64-bit position codes."""
+    codes = array('Q')
+    with open(path, 'rb') as f:
+        codes.frombytes(f.read())
+    return codes
+
+
+def _write_codes(path: str, codes):
+    """Write position codes, replacing the file only once it is complete."""
+    with open(path + ".tmp", 'wb') as f:
+        array('Q', codes).tofile(f)
+    os.replace(path + ".tmp", path)
+
+
+def generate_puzzles(
+    config: str = "3x3",
+    moves: List[int] = (2, 3),
+    path: str = PUZZLE_FILE,
+    workers: Optional[int] = None
+):
+    """Mine forced-win puzzles from every reachable position, resuming from a checkpoint.
+    
+    Next to the puzzle file, {path}.ply<n> holds the positions of the ply being
+    mined and {path}.next the children found by its finished chunks, so a
+    restart picks up at the first unfinished chunk.
+    """
+    size, k = PUZZLE_BOARDS[config]
+    moves = sorted(moves)
+    checkpoint_path = path + ".ckpt"
+    children_path = path + ".next"
+    settings = {'board': config, 'moves': moves}
+    done = None
+    
+    if os.path.exists(checkpoint_path) and os.path.exists(path):
+        with open(checkpoint_path, 'r') as f:
+            saved = json.load(f)
+        if saved.get('settings') == settings and os.path.exists(f"{path}.ply{saved['done']['ply']}"):
+            done = saved['done']
+            print(f"Resuming ply {done['ply']} after chunk {done['chunk']} ({done['records']} puzzles)")
+    
+    def save_checkpoint(state: Dict):
+        with open(checkpoint_path + ".tmp", 'w') as f:
+            json.dump({'settings': settings, 'done': state}, f)
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+    
+    if done is None:
+        with open(path, 'wb') as out:
+            out.write(PUZZLE_HEADER.pack(PUZZLE_MAGIC, size, k))
+        open(children_path, 'wb').close()
+        _write_codes(f"{path}.ply0", [0])
+        done = {'ply': 0, 'chunk': -1, 'records': 0, 'children': 0}
+        save_checkpoint(done)
+    
+    with open(path, 'r+b') as out, open(children_path, 'r+b') as children_file, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        # Drop anything written after the last checkpoint
+        out.truncate(PUZZLE_HEADER.size + done['records'] * PUZZLE_RECORD.size)
+        out.seek(0, os.SEEK_END)
+        children_file.truncate(done['children'] * 8)
+        children_file.seek(0, os.SEEK_END)
+        records, children_count = done['records'], done['children']
+        start = time.perf_counter()
+        
+        ply = done['ply']
+        frontier = _read_codes(f"{path}.ply{ply}")
+        while frontier:
+            chunks = [frontier[i:i + PUZZLE_CHUNK] for i in range(0, len(frontier), PUZZLE_CHUNK)]
+            first = done['chunk'] + 1 if ply == done['ply'] else 0
+            tasks = [(config, list(chunk), moves) for chunk in chunks[first:]]
+            
+            for number, (puzzles, children) in enumerate(pool.map(_mine_puzzle_chunk, tasks), first):
+                array('Q', children).tofile(children_file)
+                children_count += len(children)
+                for record in puzzles:
+                    out.write(PUZZLE_RECORD.pack(*record))
+                records += len(puzzles)
+                out.flush()
+                children_file.flush()
+                save_checkpoint({'ply': ply, 'chunk': number, 'records': records, 'children': children_count})
+            
+            print(f"ply {ply}: {len(frontier)} positions, {records} puzzles, "
+                  f"{time.perf_counter() - start:.1f}s")
+            # The next frontier is saved before the checkpoint moves on to it
+            children_file.seek(0)
+            following = array('Q')
+            following.frombytes(children_file.read())
+            frontier = array('Q', sorted(set(following)))
+            _write_codes(f"{path}.ply{ply + 1}", frontier)
+            save_checkpoint({'ply': ply + 1, 'chunk': -1, 'records': records, 'children': 0})
+            os.remove(f"{path}.ply{ply}")
+            children_file.seek(0)
+            children_file.truncate()
+            children_count = 0
+            ply += 1
+    
+    for leftover in (checkpoint_path, children_path, f"{path}.ply{ply}"):
+        os.remove(leftover)
+    print(f"Saved {records} puzzles to {path}")
+
+
+class PuzzleFile:
+    """Indexed puzzle file: fixed-size records, so any puzzle is one seek away."""
+    
+    def __init__(self, path: str = PUZZLE_FILE):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, self.size, self.k = PUZZLE_HEADER.unpack(f.read(PUZZLE_HEADER.size))
+        if magic != PUZZLE_MAGIC:
+            raise ValueError(f"{path} is not a puzzle file")
+        self.count = (os.path.getsize(path) - PUZZLE_HEADER.size) // PUZZLE_RECORD.size
+    
+    def get(self, puzzle_id: int) -> Dict:
+        """Read one puzzle by its ID."""
+        if not 0 <= puzzle_id < self.count:
+            raise ValueError(f"Puzzle {puzzle_id} not found (0-{self.count - 1})")
+        with open(self.path, 'rb') as f:
+            f.seek(PUZZLE_HEADER.size + puzzle_id * PUZZLE_RECORD.size)
+            code, moves, solution = PUZZLE_RECORD.unpack(f.read(PUZZLE_RECORD.size))
+        board = decode_position(code, self.size * self.size)
+        symbol = "X" if board.count("X") == board.count("O") else "O"
+        return {'id': puzzle_id, 'board': board, 'symbol': symbol, 'moves': moves, 'solution': solution}
+
+
+ANALYTICS_FILE = "tictactoe_analytics.bin"
+ANALYTICS_MAGIC = b"TTTA"
+ANALYTICS_HEADER = struct.Struct("<4sIII")  # magic, games, positions, canonical positions
+# Canonical code; every continuation won/drawn/lost by the side to move; perfect-play
+# value, plies and number of games; random-play win/draw/loss odds
+ANALYTICS_RECORD = struct.Struct("<HIIIbBIfff")
+
+
+def _game_result(cells) -> Optional[int]:
+    """-1 if the side to move has lost, 0 for a full-board draw, None while the game is on."""
+    if any(cells[a] != "" and cells[a] == cells[b] == cells[c] for a, b, c in WIN_PATTERNS):
+        return -1  # Only the player who just moved can have a line
+    return None if "" in cells else 0
+
+
+@lru_cache(maxsize=None)
+def _tree_counts(code: int) -> Tuple[int, int, int, int, int, int, float, float, float]:
+    """Statistics for a canonical position, summed over its canonical children."""
+    cells = decode_position(code, 9)
+    result = _game_result(cells)
+    if result is not None:
+        outcome = (0, 1, 0) if result == 0 else (0, 0, 1)
+        return outcome + (result, 0, 1) + tuple(float(n) for n in outcome)
+    
+    symbol = "X" if cells.count("X") == cells.count("O") else "O"
+    children = []
+    for i, cell in enumerate(cells):
+        if cell == "":
+            cells[i] = symbol
+            children.append(_tree_counts(canonical_position(cells)[0]))
+            cells[i] = ""
+    
+    # The side to move in a child is our opponent: its wins are our losses
+    wins, draws, losses = (sum(child[k] for child in children) for k in (2, 1, 0))
+    value, distance = solve_position(tuple(cells), symbol)
+    perfect_games = sum(child[5] for child in children if -child[3] == value)
+    odds = tuple(sum(child[k] for child in children) / len(children) for k in (8, 7, 6))
+    return (wins, draws, losses, value, distance, perfect_games) + odds
+
+
+def enumerate_game_tree() -> Tuple[int, int, Dict[int, tuple]]:
+    """Count every game and position; return (games, positions, records by canonical code)."""
+    level = {0}  # Codes of reachable positions with the same number of pieces
+    positions = 0
+    canonical = set()
+    while level:
+        positions += len(level)
+        following = set()
+        for code in level:
+            cells = decode_position(code, 9)
+            canonical.add(canonical_position(cells)[0])
+            if _game_result(cells) is None:
+                digit = CELL_CODES["X" if cells.count("X") == cells.count("O") else "O"]
+                following.update(code + digit * 3 ** i for i, cell in enumerate(cells) if cell == "")
+        level = following
+    
+    records = {code: _tree_counts(code) for code in sorted(canonical)}
+    return sum(records[0][:3]), positions, records
+
+
+class GameTreeAnalytics:
+    """Whole-game-tree statistics, loaded from the analytics file or built and cached there."""
+    
+    def __init__(self, path: str = ANALYTICS_FILE):
+        self.path = path
+        self.built = not self.load()
+        if self.built:
+            self.games, self.positions, self.records = enumerate_game_tree()
+            try:
+                self.save()
+            except OSError:
+                pass  # Not writable: the tree is rebuilt next time
+    
+    def load(self) -> bool:
+        """Read the cached file; False if it is missing or not an analytics file."""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+        if len(data) < ANALYTICS_HEADER.size:
+            return False
+        magic, self.games, self.positions, count = ANALYTICS_HEADER.unpack_from(data)
+        if magic != ANALYTICS_MAGIC or len(data) != ANALYTICS_HEADER.size + count * ANALYTICS_RECORD.size:
+            return False
+        self.records = {
+            record[0]: record[1:]
+            for record in ANALYTICS_RECORD.iter_unpack(data[ANALYTICS_HEADER.size:])
+        }
+        return True
+    
+    def save(self):
+        """Write the records to the analytics file."""
+        with open(self.path, 'wb') as f:
+            f.write(ANALYTICS_HEADER.pack(ANALYTICS_MAGIC, self.games, self.positions, len(self.records)))
+            for code, record in self.records.items():
+                f.write(ANALYTICS_RECORD.pack(code, *record))
+    
+    def lookup(self, board: List[str]) -> Dict:
+        """Statistics for any position, from the side to move's point of view."""
+        wins, draws, losses, value, distance, perfect_games, *odds = self.records[canonical_position(board)[0]]
+        return {
+            'games': (wins, draws, losses),
+            'perfect': (value, distance, perfect_games),
+            'random': tuple(odds)
+        }
+
+
+def print_analytics(path: str = ANALYTICS_FILE, out=sys.stdout):
+    """Print game-tree totals and one row per symmetry-distinct position."""
+    start = time.perf_counter()
+    analytics = GameTreeAnalytics(path)
+    source = "built" if analytics.built else "loaded"
+    print(f"{analytics.games} games, {analytics.positions} positions, "
+          f"{len(analytics.records)} canonical positions ({source} {path} in "
+          f"{time.perf_counter() - start:.2f} s)", file=out)
+    print("position\tto_move\twins\tdraws\tlosses\tperfect\tplies\tperfect_games\t"
+          "random_win\trandom_draw\trandom_loss", file=out)
+    outcomes = {1: "win", 0: "draw", -1: "loss"}
+    for code, (wins, draws, losses, value, distance, perfect_games, *odds) in analytics.records.items():
+        cells = decode_position(code, 9)
+        to_move = "X" if cells.count("X") == cells.count("O") else "O"
+        board = "".join(cell or "." for cell in cells)
+        odds_text = "\t".join(f"{p:.4f}" for p in odds)
+        print(f"{board}\t{to_move}\t{wins}\t{draws}\t{losses}\t{outcomes[value]}\t{distance}\t"
+              f"{perfect_games}\t{odds_text}", file=out)
+
+
+class PositionAnalyzer:
+    """Evaluates positions on a background thread, caching results per position."""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.evaluations: Dict[Tuple, Dict[int, Tuple[int, int]]] = {}
+        self.replies: Dict[Tuple, Dict[int, int]] = {}
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def request(self, board: List[str], symbol: str, ponder: Optional[Tuple[str, str]] = None):
+        """Queue analysis of board with symbol to move, superseding older requests.
+        
+        ponder is (ai_symbol, difficulty) to also precompute the AI's replies.
+        """
+        self.generation += 1
+        self.requests.put((self.generation, tuple(board), symbol, ponder))
+    
+    def invalidate(self, board: List[str]):
+        """Drop cached positions that can no longer arise from board."""
+        def reachable(cells: Tuple[str, ...]) -> bool:
+            return all(cell == placed for cell, placed in zip(cells, board) if placed != "")
+        
+        with self.lock:
+            self.evaluations = {k: v for k, v in self.evaluations.items() if reachable(k[0])}
+            self.replies = {k: v for k, v in self.replies.items() if reachable(k[0])}
+    
+    def cached_reply(self, board: List[str], difficulty: str) -> Optional[Dict[int, int]]:
+        """Return pondered root scores for the AI in this position, if any."""
+        with self.lock:
+            return self.replies.get((tuple(board), difficulty))
+    
+    def cancel(self):
+        """Abandon queued requests and any pondering in progress."""
+        self.generation += 1
+    
+    def stop(self):
+        """Stop the background thread."""
+        self.generation += 1
+        self.requests.put(None)
+    
+    def run(self):
+        """Worker loop: evaluate the latest position, then ponder replies."""
+        while True:
+            job = self.requests.get()
+            if job is None:
+                return
+            generation, cells, symbol, ponder = job
+            if generation != self.generation:
+                continue  # Superseded by a newer position
+            
+            evaluation = self.evaluate(cells, symbol)
+            self.results.put((cells, symbol, evaluation))
+            if ponder:
+                self.ponder(generation, cells, symbol, evaluation, *ponder)
+    
+    def evaluate(self, cells: Tuple[str, ...], symbol: str) -> Dict[int, Tuple[int, int]]:
+        """Outcome and distance in plies of each move for symbol."""
+        with self.lock:
+            cached = self.evaluations.get((cells, symbol))
+        if cached is not None:
+            return cached
+        
+        evaluation = move_outcomes(cells, symbol)
+        with self.lock:
+            self.evaluations[(cells, symbol)] = evaluation
+        return evaluation
+    
+    def ponder(
+        self,
+        generation: int,
+        cells: Tuple[str, ...],
+        symbol: str,
+        evaluation: Dict[int, Tuple[int, int]],
+        ai_symbol: str,
+        difficulty: str
+    ):
+        """Search the AI's reply to each human move, most likely moves first."""
+        for i in sorted(evaluation, key=lambda i: _outcome_key(evaluation[i]), reverse=True):
+            if generation != self.generation:
+                return
+            child = cells[:i] + (symbol,) + cells[i + 1:]
+            if evaluation[i] == (1, 1) or "" not in child:
+                continue  # Game ends, nothing to reply to
+            
+            with self.lock:
+                if (child, difficulty) in self.replies:
+                    continue
+            scores = MoveSearch.for_level(difficulty).search(list(child), ai_symbol, symbol)
+            with self.lock:
+                self.replies[(child, difficulty)] = dict(scores)
+
+
+def _build_qubic_lines() -> List[List[int]]:
+    """The 76 winning lines of the 4x4x4 cube (cell = layer * 16 + row * 4 + col)."""
+    directions = [
+        (dz, dy, dx)
+        for dz in (-1, 0, 1) for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+        if (dz, dy, dx) > (0, 0, 0)
+    ]
+    lines = []
+    for dz, dy, dx in directions:
+        for z in range(4):
+            for y in range(4):
+                for x in range(4):
+                    cells = [(z + k * dz, y + k * dy, x + k * dx) for k in range(4)]
+                    if all(0 <= c < 4 for cell in cells for c in cell):
+                        lines.append([cz * 16 + cy * 4 + cx for cz, cy, cx in cells])
+    return lines
+
+
+QUBIC_LINES = _build_qubic_lines()
+QUBIC_MASKS = [sum(1 << i for i in line) for line in QUBIC_LINES]
+QUBIC_CELL_LINES = _line_numbers_through(QUBIC_LINES)
+# Cells on more lines first: the 8 corners and 8 inner cells sit on 7 lines each
+QUBIC_CELL_ORDER = sorted(range(64), key=lambda i: -len(QUBIC_CELL_LINES[i]))
+QUBIC_WIN_SCORE = 1000000
+QUBIC_LINE_WEIGHTS = [0, 1, 8, 64, 0]
+# Value of a line holding a pieces of the root player and b of the opponent
+QUBIC_LINE_VALUES = [
+    [QUBIC_LINE_WEIGHTS[a] if b == 0 else (-QUBIC_LINE_WEIGHTS[b] if a == 0 else 0) for b in range(5)]
+    for a in range(5)
+]
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class QubicSearch(MoveSearch):
+    """Bitboard alpha-beta search for 4x4x4 Qubic with threats and a transposition table."""
+    
+    default_lines = QUBIC_LINES
+    win_score = QUBIC_WIN_SCORE
+    
+    def prepare(self, board: List[str], symbol: str, opponent: str):
+        """Set up bitboards and line counts for the root position."""
+        # Side 0 is the player to move at the root, side 1 the opponent
+        self.bits = [0, 0]
+        self.counts = [[0] * len(QUBIC_LINES), [0] * len(QUBIC_LINES)]
+        self.threes = [set(), set()]
+        self.score = 0
+        for i, cell in enumerate(board):
+            if cell != "":
+                self.play(i, 0 if cell == symbol else 1)
+        self.table: Dict[Tuple[int, int], Tuple[int, int, float, Optional[int]]] = {}
+    
+    def root_moves(self) -> List[int]:
+        """Empty cells, those on the most lines first."""
+        occupied = self.bits[0] | self.bits[1]
+        return [i for i in QUBIC_CELL_ORDER if not occupied >> i & 1]
+    
+    def score_move(self, move: int, depth: int, lower: float) -> float:
+        """Score one root move to depth; exact when above lower, else an upper bound."""
+        self.play(move, 0)
+        if any(self.counts[0][n] == 4 for n in QUBIC_CELL_LINES[move]):
+            score = QUBIC_WIN_SCORE - 1
+        else:
+            score = -self.negamax(1, depth - 1, -float('inf'), -lower, 2)
+        self.undo(move, 0)
+        return score
+    
+    def play(self, cell: int, side: int):
+        """Place a piece and update line counts, threats and evaluation."""
+        counts = self.counts[side]
+        for n in QUBIC_CELL_LINES[cell]:
+            self.score -= QUBIC_LINE_VALUES[self.counts[0][n]][self.counts[1][n]]
+            counts[n] += 1
+            self.score += QUBIC_LINE_VALUES[self.counts[0][n]][self.counts[1][n]]
+            self.update_threat(n)
+        self.bits[side] |= 1 << cell
+    
+    def undo(self, cell: int, side: int):
+        """Take back a piece placed with play."""
+        counts = self.counts[side]
+        for n in QUBIC_CELL_LINES[cell]:
+            self.score -= QUBIC_LINE_VALUES[self.counts[0][n]][self.counts[1][n]]
+            counts[n] -= 1
+            self.score += QUBIC_LINE_VALUES[self.counts[0][n]][self.counts[1][n]]
+            self.update_threat(n)
+        self.bits[side] &= ~(1 << cell)
+    
+    def update_threat(self, n: int):
+        """Track lines where one side needs a single cell to win."""
+        a, b = self.counts[0][n], self.counts[1][n]
+        for side, own, theirs in ((0, a, b), (1, b, a)):
+            if own == 3 and theirs == 0:
+                self.threes[side].add(n)
+            else:
+                self.threes[side].discard(n)
+    
+    def threats(self, side: int) -> List[int]:
+        """Empty cells that would complete a line for side."""
+        occupied = self.bits[0] | self.bits[1]
+        return list({(QUBIC_MASKS[n] & ~occupied).bit_length() - 1 for n in self.threes[side]})
+    
+    def negamax(self, side: int, depth: int, alpha: float, beta: float, ply: int) -> float:
+        """Score the position for side, the player to move."""
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SearchTimeout()
+        if self.nodes % 64 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        
+        if self.threes[side]:
+            return QUBIC_WIN_SCORE - ply  # Completes a line this move
+        blocks = self.threats(1 - side)
+        if len(blocks) > 1:
+            return -(QUBIC_WIN_SCORE - ply - 1)  # Cannot stop two threats
+        occupied = self.bits[0] | self.bits[1]
+        if occupied == (1 << 64) - 1:
+            return 0
+        if depth == 0:
+            return self.score if side == 0 else -self.score
+        
+        key = (self.bits[0], self.bits[1])
+        entry = self.table.get(key)
+        hint = None
+        if entry is not None:
+            entry_depth, flag, value, hint = entry
+            # Only same-depth results: deeper ones would make scores depend on
+            # search history, and root-split workers start with empty tables
+            if entry_depth == depth:
+                if flag == EXACT:
+                    return value
+                if flag == LOWER and value >= beta:
+                    return value
+                if flag == UPPER and value <= alpha:
+                    return value
+        
+        if blocks:
+            moves = blocks  # Forced block
+        else:
+            moves = [i for i in QUBIC_CELL_ORDER if not occupied >> i & 1]
+            if hint is not None and hint in moves:
+                moves.remove(hint)
+                moves.insert(0, hint)
+        
+        original_alpha = alpha
+        best, best_move = -float('inf'), None
+        for i in moves:
+            self.play(i, side)
+            score = -self.negamax(1 - side, depth - 1, -beta, -alpha, ply + 1)
+            self.undo(i, side)
+            
+            if score > best:
+                best, best_move = score, i
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
+        
+        if best <= original_alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table[key] = (depth, flag, best, best_move)
+        return best
+
+
+WIN_MASKS = [sum(1 << i for i in pattern) for pattern in WIN_PATTERNS]
+FULL_MASK = (1 << 9) - 1
+# Lookup tables indexed by a 9-bit mask of one 3x3 board
+LINE_COMPLETE = [any(mask & m == m for m in WIN_MASKS) for mask in range(1 << 9)]
+OPEN_CELLS = [[c for c in range(9) if not mask >> c & 1] for mask in range(1 << 9)]
+# Legal global moves in local board b given its occupancy mask
+BOARD_MOVES = [[[b * 9 + c for c in OPEN_CELLS[mask]] for mask in range(1 << 9)] for b in range(9)]
+ULTIMATE_WIN_SCORE = 1000000
+
+
+@lru_cache(maxsize=None)
+def _line_potential(own: int, theirs: int) -> int:
+    """Heuristic value of a 3x3 board: lines still open to one side, weighted by pieces."""
+    weights = [0, 1, 5, 25]
+    score = 0
+    for mask in WIN_MASKS:
+        if not theirs & mask:
+            score += weights[bin(own & mask).count("1")]
+        elif not own & mask:
+            score -= weights[bin(theirs & mask).count("1")]
+    return score
+
+
+class UltimateState:
+    """Ultimate tic-tac-toe position with local and meta results kept incrementally.
+    
+    Cell index = local board * 9 + cell within that board.
+    """
+    
+    def __init__(self):
+        self.cells = [""] * 81
+        self.local = {"X": [0] * 9, "O": [0] * 9}
+        self.filled = [0] * 9
+        self.status = [""] * 9  # "", "X", "O" or "draw"
+        self.meta = {"X": 0, "O": 0}
+        self.decided = 0
+        self.active: Optional[int] = None
+        self.winner = ""
+        self.history: List[Tuple[int, Optional[int], str]] = []
+    
+    @classmethod
+    def from_cells(cls, cells: List[str], active: Optional[int] = None) -> "UltimateState":
+        """Rebuild a position from its cells and the board the next move must go in."""
+        state = cls()
+        for index, cell in enumerate(cells):
+            if cell != "":
+                state.play(index, cell)
+        state.history.clear()
+        state.active = active
+        return state
+    
+    def legal_moves(self) -> List[int]:
+        """Moves allowed by the active-board constraint."""
+        if self.winner:
+            return []
+        if self.active is not None:
+            return BOARD_MOVES[self.active][self.filled[self.active]]
+        return [
+            move
+            for b in range(9) if not self.decided >> b & 1
+            for move in BOARD_MOVES[b][self.filled[b]]
+        ]
+    
+    def play(self, index: int, symbol: str):
+        """Place symbol at index and update the local, meta and active-board state."""
+        b, c = divmod(index, 9)
+        self.history.append((index, self.active, self.status[b]))
+        self.cells[index] = symbol
+        self.local[symbol][b] |= 1 << c
+        self.filled[b] |= 1 << c
+        
+        if not self.status[b]:
+            if LINE_COMPLETE[self.local[symbol][b]]:
+                self.status[b] = symbol
+                self.meta[symbol] |= 1 << b
+                self.decided |= 1 << b
+                if LINE_COMPLETE[self.meta[symbol]]:
+                    self.winner = symbol
+            elif self.filled[b] == FULL_MASK:
+                self.status[b] = "draw"
+                self.decided |= 1 << b
+        
+        # The cell played picks the opponent's board, unless that board is finished
+        self.active = None if self.decided >> c & 1 else c
+    
+    def undo(self):
+        """Take back the last move."""
+        index, active, status = self.history.pop()
+        b, c = divmod(index, 9)
+        symbol = self.cells[index]
+        self.cells[index] = ""
+        self.local[symbol][b] &= ~(1 << c)
+        self.filled[b] &= ~(1 << c)
+        
+        if self.status[b] != status:
+            if self.status[b] == symbol:
+                self.meta[symbol] &= ~(1 << b)
+            self.status[b] = status
+            self.decided &= ~(1 << b)
+        self.winner = ""
+        self.active = active
+    
+    def evaluate(self, symbol: str, opponent: str) -> int:
+        """Heuristic score for symbol: meta-board lines dominate local ones."""
+        drawn = self.decided & ~(self.meta[symbol] | self.meta[opponent])
+        score = 100 * _line_potential(self.meta[symbol], self.meta[opponent] | drawn)
+        for b in range(9):
+            if not self.decided >> b & 1:
+                score += _line_potential(self.local[symbol][b], self.local[opponent][b])
+        return score
+
+
+class UltimateSearch(MoveSearch):
+    """Time-budgeted alpha-beta search over Ultimate tic-tac-toe positions."""
+    
+    win_score = ULTIMATE_WIN_SCORE
+    
+    def prepare(self, board: List[str], symbol: str, opponent: str, active: Optional[int] = None):
+        """Set up the root position; active is the local board the move must go in."""
+        self.state = UltimateState.from_cells(board, active)
+        self.symbol = symbol
+        self.opponent = opponent
+    
+    def root_moves(self) -> List[int]:
+        """Legal moves in the active board, or anywhere open."""
+        return self.state.legal_moves()
+    
+    def score_move(self, move: int, depth: int, lower: float) -> float:
+        """Score one root move to depth; exact when above lower, else an upper bound."""
+        state = self.state
+        state.play(move, self.symbol)
+        if state.winner:
+            score = ULTIMATE_WIN_SCORE - 1
+        else:
+            score = -self.negamax(state, self.opponent, self.symbol, depth - 1, -float('inf'), -lower, 2)
+        state.undo()
+        return score
+    
+    def negamax(
+        self,
+        state: UltimateState,
+        symbol: str,
+        opponent: str,
+        depth: int,
+        alpha: float,
+        beta: float,
+        ply: int
+    ) -> float:
+        """Score the position for symbol, the side to move."""
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SearchTimeout()
+        if self.nodes % 64 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        
+        moves = state.legal_moves()
+        if not moves:
+            return 0  # Every local board is decided without a meta win
+        if depth == 0:
+            return state.evaluate(symbol, opponent)
+        
+        best = -float('inf')
+        for i in moves:
+            state.play(i, symbol)
+            if state.winner:
+                score = ULTIMATE_WIN_SCORE - ply
+            else:
+                score = -self.negamax(state, opponent, symbol, depth - 1, -beta, -alpha, ply + 1)
+            state.undo()
+            
+            if score > best:
+                best = score
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
+        return best
+
+
+GOMOKU_SIZE = 15
+GOMOKU_CELLS = GOMOKU_SIZE * GOMOKU_SIZE
+# Search deadline, leaving headroom under the 100 ms reply target
+GOMOKU_MAX_RESPONSE_TIME = 0.09
+# Every run of five cells along rows, columns and both diagonals
+GOMOKU_WINDOWS = _build_grid_lines(GOMOKU_SIZE, 5)
+GOMOKU_CELL_WINDOWS = _line_numbers_through(GOMOKU_WINDOWS)
+# Cells within two steps of each cell: where candidate moves come from
+GOMOKU_NEIGHBORS = [
+    [
+        ny * GOMOKU_SIZE + nx
+        for ny in range(max(0, y - 2), min(GOMOKU_SIZE, y + 3))
+        for nx in range(max(0, x - 2), min(GOMOKU_SIZE, x + 3))
+        if (ny, nx) != (y, x)
+    ]
+    for y in range(GOMOKU_SIZE) for x in range(GOMOKU_SIZE)
+]
+# Value of a window holding n stones of one side and none of the other
+GOMOKU_WEIGHTS = [0, 1, 10, 100, 1000, 100000]
+GOMOKU_WIN_SCORE = 10000000
+GOMOKU_BRANCHING = 12
+GOMOKU_VCF_DEPTH = 8
+GOMOKU_SIDES = {"X": 0, "O": 1}
+
+
+class GomokuIndex:
+    """Gomoku position with an incrementally maintained index of line patterns.
+    
+    Every five-cell window keeps its stone count per side. Playing a stone only
+    touches the windows along the four directions through it, and from those
+    updates the index keeps, per side: each cell's pattern value, the windows
+    one stone from five (fours) and two stones from five (threes), and the
+    total position value. Sides are 0 (X) and 1 (O).
+    """
+    
+    def __init__(self):
+        self.stones = [-1] * GOMOKU_CELLS
+        self.counts = [[0] * len(GOMOKU_WINDOWS), [0] * len(GOMOKU_WINDOWS)]
+        self.cell_values = [[0] * GOMOKU_CELLS, [0] * GOMOKU_CELLS]
+        self.fours = [set(), set()]
+        self.threes = [set(), set()]
+        self.totals = [0, 0]
+        self.near = [0] * GOMOKU_CELLS
+        self.candidates = set()
+        self.placed = 0
+        for n, window in enumerate(GOMOKU_WINDOWS):
+            for cell in window:
+                self.cell_values[0][cell] += GOMOKU_WEIGHTS[1]
+                self.cell_values[1][cell] += GOMOKU_WEIGHTS[1]
+    
+    @classmethod
+    def from_cells(cls, cells: List[str]) -> "GomokuIndex":
+        """Build the index for a board by playing its stones."""
+        index = cls()
+        for i, cell in enumerate(cells):
+            if cell != "":
+                index.play(i, GOMOKU_SIDES[cell])
+        return index
+    
+    def copy(self) -> "GomokuIndex":
+        """An independent copy, cheaper than replaying the stones."""
+        index = GomokuIndex.__new__(GomokuIndex)
+        index.stones = list(self.stones)
+        index.counts = [list(self.counts[0]), list(self.counts[1])]
+        index.cell_values = [list(self.cell_values[0]), list(self.cell_values[1])]
+        index.fours = [set(self.fours[0]), set(self.fours[1])]
+        index.threes = [set(self.threes[0]), set(self.threes[1])]
+        index.totals = list(self.totals)
+        index.near = list(self.near)
+        index.candidates = set(self.candidates)
+        index.placed = self.placed
+        return index
+    
+    def window_value(self, n: int, side: int) -> Tuple[int, int]:
+        """(window value, value of adding one more stone) for side."""
+        if self.counts[1 - side][n]:
+            return 0, 0
+        own = self.counts[side][n]
+        return GOMOKU_WEIGHTS[own], GOMOKU_WEIGHTS[min(own + 1, 5)]
+    
+    def play(self, cell: int, side: int):
+        """Place a stone, updating only the windows through cell."""
+        self.update(cell, side, 1)
+        self.stones[cell] = side
+        self.placed += 1
+        self.candidates.discard(cell)
+        for neighbor in GOMOKU_NEIGHBORS[cell]:
+            self.near[neighbor] += 1
+            if self.stones[neighbor] < 0:
+                self.candidates.add(neighbor)
+    
+    def undo(self, cell: int):
+        """Remove the stone at cell."""
+        side = self.stones[cell]
+        self.stones[cell] = -1
+        self.placed -= 1
+        self.update(cell, side, -1)
+        for neighbor in GOMOKU_NEIGHBORS[cell]:
+            self.near[neighbor] -= 1
+            if not self.near[neighbor]:
+                self.candidates.discard(neighbor)
+        if self.near[cell]:
+            self.candidates.add(cell)
+    
+    def update(self, cell: int, side: int, delta: int):
+        """Apply a stone change to the windows through cell and their cells."""
+        for n in GOMOKU_CELL_WINDOWS[cell]:
+            before = (self.window_value(n, 0), self.window_value(n, 1))
+            self.counts[side][n] += delta
+            after = (self.window_value(n, 0), self.window_value(n, 1))
+            
+            for s in (0, 1):
+                (old_total, old_gain), (new_total, new_gain) = before[s], after[s]
+                self.totals[s] += new_total - old_total
+                if new_gain != old_gain:
+                    for c in GOMOKU_WINDOWS[n]:
+                        self.cell_values[s][c] += new_gain - old_gain
+                
+                own, theirs = self.counts[s][n], self.counts[1 - s][n]
+                for group, size in ((self.fours[s], 4), (self.threes[s], 3)):
+                    if own == size and not theirs:
+                        group.add(n)
+                    else:
+                        group.discard(n)
+    
+    def five_cells(self, side: int) -> List[int]:
+        """Empty cells where side would complete five."""
+        return sorted({c for n in self.fours[side] for c in GOMOKU_WINDOWS[n] if self.stones[c] < 0})
+    
+    def four_cells(self, side: int) -> List[int]:
+        """Empty cells where side would make a four (a threat of five)."""
+        return sorted({c for n in self.threes[side] for c in GOMOKU_WINDOWS[n] if self.stones[c] < 0})
+    
+    def ordered_candidates(self, side: int) -> List[int]:
+        """Nearby empty cells, best attack plus defence value first (ties by cell)."""
+        attack, defend = self.cell_values[side], self.cell_values[1 - side]
+        return sorted(self.candidates, key=lambda c: (-(attack[c] + defend[c]), c))[:GOMOKU_BRANCHING]
+    
+    def won(self, cell: int, side: int) -> bool:
+        """Check whether the stone at cell completed five for side."""
+        return any(self.counts[side][n] == 5 for n in GOMOKU_CELL_WINDOWS[cell])
+
+
+class GomokuSearch(MoveSearch):
+    """Gomoku AI: threat-space search for forced wins, then budgeted alpha-beta."""
+    
+    default_lines = GOMOKU_WINDOWS
+    response_time = GOMOKU_MAX_RESPONSE_TIME
+    win_score = GOMOKU_WIN_SCORE
+    # Each worker would rebuild the pattern index for a 90 ms search
+    split_root = False
+    
+    def prepare(
+        self,
+        board: List[str],
+        symbol: str,
+        opponent: str,
+        index: Optional[GomokuIndex] = None
+    ):
+        """Take a copy of the game's pattern index, or build one for the board."""
+        # A copy, because a timeout deep in the search leaves stones on it
+        self.index = index.copy() if index is not None else GomokuIndex.from_cells(board)
+        self.side = GOMOKU_SIDES[symbol]
+    
+    def root_moves(self) -> List[int]:
+        """Candidate moves, or the move itself when it is forced or a forced win."""
+        index, side = self.index, self.side
+        if not index.placed:
+            self.scores = {GOMOKU_CELLS // 2: 0}
+            return []
+        
+        wins = index.five_cells(side)
+        if wins:
+            self.scores = {cell: GOMOKU_WIN_SCORE - 1 for cell in wins}
+            return []
+        
+        moves = index.five_cells(1 - side)  # Must block
+        if not moves:
+            try:
+                winning = self.vcf(side, GOMOKU_VCF_DEPTH)
+            except SearchTimeout:
+                winning = None
+            if winning is not None:
+                self.scores = {winning: GOMOKU_WIN_SCORE - 2}
+                return []
+            moves = index.ordered_candidates(side)
+        return moves
+    
+    def score_move(self, move: int, depth: int, lower: float) -> float:
+        """Score one root move to depth; exact when above lower, else an upper bound."""
+        index, side = self.index, self.side
+        index.play(move, side)
+        if index.won(move, side):
+            score = GOMOKU_WIN_SCORE - 1
+        else:
+            score = -self.negamax(1 - side, depth - 1, -float('inf'), -lower, 2)
+        index.undo(move)
+        return score
+    
+    def count_node(self):
+        """Charge one node against the budget."""
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SearchTimeout()
+        # Nodes are expensive here and the deadline is tight, so check often
+        if self.nodes % 8 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+    
+    def vcf(self, side: int, depth: int) -> Optional[int]:
+        """Threat-space search over fours: a move starting a forced win, or None.
+        
+        Every attacking move makes a four, so the defender's reply is forced
+        to the one cell that stops five; a double four ends the sequence.
+        """
+        if depth == 0:
+            return None
+        index = self.index
+        for cell in index.four_cells(side):
+            self.count_node()
+            # Undo in finally: a timeout deeper down must leave the index as it was,
+            # since root_moves goes on to search it
+            index.play(cell, side)
+            try:
+                threats = index.five_cells(side)
+                if len(threats) > 1:
+                    return cell  # Two fives at once cannot both be blocked
+                if len(threats) == 1:
+                    block = threats[0]
+                    index.play(block, 1 - side)
+                    try:
+                        # The block must not give the defender a four of their own
+                        if not index.five_cells(1 - side) and self.vcf(side, depth - 1) is not None:
+                            return cell
+                    finally:
+                        index.undo(block)
+            finally:
+                index.undo(cell)
+        return None
+    
+    def negamax(self, side: int, depth: int, alpha: float, beta: float, ply: int) -> float:
+        """Score the position for side, the player to move."""
+        self.count_node()
+        index = self.index
+        if index.fours[side]:
+            return GOMOKU_WIN_SCORE - ply  # Completes five this move
+        blocks = index.five_cells(1 - side)
+        if len(blocks) > 1:
+            return -(GOMOKU_WIN_SCORE - ply - 1)
+        if index.placed == GOMOKU_CELLS:
+            return 0
+        if depth == 0:
+            return index.totals[side] - index.totals[1 - side]
+        
+        best = -float('inf')
+        for i in blocks or index.ordered_candidates(side):
+            index.play(i, side)
+            score = -self.negamax(1 - side, depth - 1, -beta, -alpha, ply + 1)
+            index.undo(i)
+            
+            if score > best:
+                best = score
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
+        return best
+
+
+# External engine protocol (one command per line, UCI-style):
+#   tictactoe                                  -> id name <name> ... tictactoeok
+#   isready                                    -> readyok
+#   position <variant> <cells> <symbol> [<option> <value>]...
+#       cells has one character per cell: '.', 'X' or 'O'
+#       option "active" gives Ultimate's active local board
+#   go movetime <ms>                           -> info ... lines, then bestmove <cell>
+#   quit
+# Malformed commands are answered with "info string error <message>"; a go
+# without a valid position answers "bestmove none".
+ENGINE_SEARCHES = {
+    "classic": MoveSearch,
+    "qubic": QubicSearch,
+    "ultimate": UltimateSearch,
+    "gomoku": GomokuSearch
+}
+ENGINE_POOL_SIZE = 2
+# Share of the move deadline the engine may search; the rest covers the pipe round trip
+ENGINE_MOVETIME_SHARE = 0.8
+# Share of a move's time limit the engine gets; the rest covers the fallback search
+ENGINE_DEADLINE_SHARE = 0.7
+
+
+class EngineError(Exception):
+    """Raised when an external engine fails, exits or misses its deadline."""
+
+
+def parse_engine_position(tokens: List[str]) -> Tuple[str, List[str], str, Optional[int]]:
+    """Parse the arguments of a position command, raising ValueError if they are malformed."""
+    if len(tokens) < 3:
+        raise ValueError("position needs <variant> <cells> <symbol>")
+    variant, cells, symbol = tokens[:3]
+    if variant not in ENGINE_SEARCHES:
+        raise ValueError(f"unknown variant {variant}")
+    if len(cells) != VARIANT_CELLS[variant] or set(cells) - set(".XO"):
+        raise ValueError(f"{variant} cells must be {VARIANT_CELLS[variant]} of '.', 'X' or 'O'")
+    if symbol not in ("X", "O"):
+        raise ValueError(f"symbol must be X or O, not {symbol}")
+    options = dict(zip(tokens[3::2], tokens[4::2]))
+    active = None
+    if "active" in options:
+        if variant != "ultimate" or not options["active"].isdigit() or int(options["active"]) > 8:
+            raise ValueError(f"bad active board {options['active']}")
+        active = int(options["active"])
+    return variant, [c if c != "." else "" for c in cells], symbol, active
+
+
+def run_engine(stdin=sys.stdin, stdout=sys.stdout):
+    """Serve the engine protocol with the built-in searches."""
+    position = None
+    for line in stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        
+        if command == "tictactoe":
+            stdout.write("id name Tic-Tac-Toe Ultimate\n")
+            stdout.write(f"id variants {' '.join(ENGINE_SEARCHES)}\n")
+            stdout.write("tictactoeok\n")
+        elif command == "isready":
+            stdout.write("readyok\n")
+        elif command == "position":
+            try:
+                position = parse_engine_position(tokens[1:])
+            except ValueError as e:
+                position = None
+                stdout.write(f"info string error {e}\n")
+        elif command == "go":
+            movetime = tokens[tokens.index("movetime") + 1] if "movetime" in tokens[:-1] else "1000"
+            if position is None or not movetime.isdigit():
+                reason = "go without a valid position" if position is None else f"bad movetime {movetime}"
+                stdout.write(f"info string error {reason}\n")
+                stdout.write("bestmove none\n")
+            else:
+                variant, board, symbol, active = position
+                search = ENGINE_SEARCHES[variant](time_budget=int(movetime) / 1000)
+                opponent = "O" if symbol == "X" else "X"
+                if variant == "ultimate":
+                    scores = search.search(board, symbol, opponent, active)
+                else:
+                    scores = search.search(board, symbol, opponent)
+                
+                if scores:
+                    move = search.select(scores)
+                    stdout.write(f"info depth {search.depth} nodes {search.nodes} score {scores[move]}\n")
+                    stdout.write(f"bestmove {move}\n")
+                else:
+                    stdout.write("bestmove none\n")
+        elif command == "quit":
+            break
+        else:
+            stdout.write(f"info string error unknown command {command}\n")
+        stdout.flush()
+
+
+def default_engine_command() -> List[str]:
+    """Engine command from TICTACTOE_ENGINE, or this program's built-in engine."""
+    command = os.environ.get("TICTACTOE_ENGINE")
+    if command:
+        return shlex.split(command)
+    return [sys.executable, os.path.abspath(__file__), "--engine"]
+
+
+class EngineProcess:
+    """A long-lived engine subprocess; requests are pipelined and answered in order."""
+    
+    def __init__(self, command: List[str]):
+        self.command = command
+        self.lock = threading.Lock()
+        self.start()
+    
+    def start(self):
+        """Launch the engine and its output reader."""
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1
+        )
+        self.pending = collections.deque()
+        threading.Thread(target=self.read_loop, args=(self.process, self.pending), daemon=True).start()
+        self.send("tictactoe\nisready\n")
+    
+    def send(self, text: str):
+        """Write protocol lines to the engine."""
+        self.process.stdin.write(text)
+        self.process.stdin.flush()
+    
+    def read_loop(self, process: subprocess.Popen, pending: collections.deque):
+        """Match each bestmove line to the oldest outstanding request."""
+        info = []
+        for line in process.stdout:
+            if line.startswith("info"):
+                info.append(line.strip())
+            elif line.startswith("bestmove"):
+                with self.lock:
+                    future = pending.popleft() if pending else None
+                if future is not None and not future.done():
+                    move = line.split()[1]
+                    future.set_result((int(move) if move.isdigit() else None, info))
+                info = []
+        
+        # The engine exited: reap it and fail whatever it still owed us
+        process.wait()
+        with self.lock:
+            while pending:
+                future = pending.popleft()
+                if not future.done():
+                    future.set_exception(EngineError("engine exited"))
+    
+    def submit(self, position: str, movetime_ms: int) -> Future:
+        """Queue a search without waiting for earlier ones to finish."""
+        future = Future()
+        with self.lock:
+            self.pending.append(future)
+            try:
+                self.send(f"{position}\ngo movetime {movetime_ms}\n")
+            except OSError as e:
+                self.pending.pop()
+                future.set_exception(EngineError(str(e)))
+        return future
+    
+    def restart(self):
+        """Kill a stuck or dead engine and start a fresh one in its place."""
+        # The old reader thread reaps the process, so this never waits for it
+        self.process.kill()
+        self.start()
+    
+    def close(self):
+        """Ask the engine to quit, killing it if it does not."""
+        try:
+            self.send("quit\n")
+            self.process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+class EnginePool:
+    """Warm engine processes shared by all games."""
+    
+    def __init__(self, command: Optional[List[str]] = None, size: int = ENGINE_POOL_SIZE):
+        self.command = command or default_engine_command()
+        self.engines = [EngineProcess(self.command) for _ in range(size)]
+    
+    def best_move(self, position: str, deadline: float) -> Tuple[Optional[int], List[str]]:
+        """Best move and info lines for a position line, within deadline seconds."""
+        engine = min(self.engines, key=lambda e: len(e.pending))
+        if engine.process.poll() is not None:
+            engine.restart()  # Exited since its last move
+        future = engine.submit(position, int(deadline * ENGINE_MOVETIME_SHARE * 1000))
+        try:
+            return future.result(timeout=deadline)
+        except FutureTimeout:
+            engine.restart()
+            raise EngineError("engine missed its deadline")
+        except EngineError:
+            engine.restart()
+            raise
+    
+    def close(self):
+        """Shut down every engine process."""
+        for engine in self.engines:
+            engine.close()
+
+
+VARIANT_CELLS = {"classic": 9, "qubic": 64, "ultimate": 81, "gomoku": GOMOKU_CELLS}
+VARIANT_LINES = {"classic": WIN_PATTERNS, "qubic": QUBIC_LINES, "gomoku": GOMOKU_WINDOWS}
+BATCH_CHUNK = 64
+
+
+def board_winner(variant: str, cells: List[str]) -> Optional[str]:
+    """The side with a completed line, if any; ValueError if both sides have one."""
+    if variant == "ultimate":
+        meta = UltimateState.from_cells(cells).meta
+        winners = [symbol for symbol in "XO" if LINE_COMPLETE[meta[symbol]]]
+    else:
+        lines = VARIANT_LINES[variant]
+        winners = [symbol for symbol in "XO" if any(all(cells[i] == symbol for i in line) for line in lines)]
+    if len(winners) == 2:
+        raise ValueError("both sides have a line")
+    return winners[0] if winners else None
+
+
+def _check_reachable(variant: str, cells: List[str]):
+    """Raise ValueError for a board that no legal game can reach."""
+    x, o = cells.count("X"), cells.count("O")
+    if not 0 <= x - o <= 1:
+        raise ValueError(f"impossible piece counts: {x} X and {o} O")
+    winner = board_winner(variant, cells)
+    # The winner made the last move, so the piece counts must show it
+    if winner and (x == o) != (winner == "O"):
+        raise ValueError(f"{winner} has a line but the piece counts say the game went on")
+
+
+def parse_position(variant: str, text: str) -> Tuple[List[str], Optional[int]]:
+    """Read a board string ('X..O.....') or a move list ('4 0 8') into cells.
+    
+    Also returns Ultimate's active board, which only a move list can tell.
+    """
+    cell_count = VARIANT_CELLS[variant]
+    compact = text.replace(" ", "")
+    if len(compact) == cell_count and set(compact) <= set("XOxo.-_"):
+        cells = ["" if c in ".-_" else c.upper() for c in compact]
+        _check_reachable(variant, cells)
+        return cells, None
+    
+    try:
+        moves = [int(token) for token in text.replace(",", " ").split()]
+    except ValueError:
+        raise ValueError(f"expected {cell_count} cells or a list of moves")
+    
+    cells = [""] * cell_count
+    state = UltimateState() if variant == "ultimate" else None
+    symbol, over = "X", False
+    for ply, move in enumerate(moves, 1):
+        if over or not 0 <= move < cell_count or cells[move] != "":
+            raise ValueError(f"illegal move {move} at ply {ply}")
+        if state is not None:
+            if move not in state.legal_moves():
+                raise ValueError(f"illegal move {move} at ply {ply}")
+            state.play(move, symbol)
+            over = bool(state.winner)
+        cells[move] = symbol
+        if state is None:
+            over = completes_line(cells, move, symbol, _lines_through(VARIANT_LINES[variant]))
+        symbol = "O" if symbol == "X" else "X"
+    return cells, state.active if state is not None else None
+
+
+def analyze_position(variant: str, level: str, text: str) -> Dict:
+    """AI move, evaluation and game status for one position."""
+    cells, active = parse_position(variant, text)
+    symbol = "X" if cells.count("X") == cells.count("O") else "O"
+    opponent = "O" if symbol == "X" else "X"
+    result = {'to_move': symbol}
+    
+    winner = board_winner(variant, cells)
+    if variant == "ultimate":
+        has_moves = bool(UltimateState.from_cells(cells, active).legal_moves())
+    else:
+        has_moves = "" in cells
+    if winner:
+        result.update(status="win", winner=winner)
+        return result
+    if not has_moves:
+        result.update(status="draw")
+        return result
+    
+    search = ENGINE_SEARCHES[variant].for_level(level)
+    if variant == "ultimate":
+        scores = search.search(cells, symbol, opponent, active)
+    else:
+        scores = search.search(cells, symbol, opponent)
+    move = search.select(scores)
+    result.update(status="ongoing", move=move, score=scores[move], depth=search.depth, nodes=search.nodes)
+    
+    if variant == "classic":
+        # The small board is solved exactly
+        value, distance = solve_position(tuple(cells), symbol)
+        result.update(value=["loss", "draw", "win"][value + 1], distance=distance)
+    return result
+
+
+def _analyze_batch(task: Tuple[str, str, List[Tuple[int, str]]]) -> List[str]:
+    """Analyze a chunk of input lines, returning one JSON line each."""
+    variant, level, lines = task
+    output = []
+    for number, text in lines:
+        record = {'line': number, 'input': text}
+        try:
+            record.update(analyze_position(variant, level, text))
+        except ValueError as e:
+            record['error'] = str(e)
+        output.append(json.dumps(record))
+    return output
+
+
+def run_batch(source, variant: str = "classic", level: str = "unbeatable", workers: Optional[int] = None, out=sys.stdout):
+    """Stream positions from source to JSON lines on out, in input order.
+    
+    Chunks are analyzed in parallel, but only a few are in flight at once,
+    so memory stays constant however long the input is.
+    """
+    def chunks():
+        chunk = []
+        for number, line in enumerate(source, 1):
+            text = line.strip()
+            if not text or text.startswith("#"):
+                continue
+            chunk.append((number, text))
+            if len(chunk) == BATCH_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    def write(lines: List[str]):
+        for line in lines:
+            out.write(line + "\n")
+        out.flush()
+    
+    in_flight = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        try:
+            for chunk in chunks():
+                pending.append(pool.submit(_analyze_batch, (variant, level, chunk)))
+                if len(pending) >= in_flight:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+        except BrokenPipeError:
+            # The reader has gone (e.g. piped into head): drop the queued chunks quietly
+            for future in pending:
+                future.cancel()
+            if out is sys.stdout:
+                # Keep the flush at exit from failing on the closed pipe again
+                os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+
+
+SOUND_RATE = 22050
+SOUND_CHANNELS = 8
+# Synthesized effects as (frequency Hz, seconds) notes, used when no <name>.wav exists
+SOUND_EFFECTS = {
+    'click': [(1000, 0.03)],
+    'move': [(660, 0.06)],
+    'win': [(523, 0.09), (659, 0.09), (784, 0.09), (1047, 0.2)],
+    'draw': [(440, 0.15), (330, 0.25)]
+}
+
+
+def synthesize_effect(notes: List[Tuple[float, float]], rate: int, channels: int) -> array:
+    """Render notes as 16-bit sine tones with short fades to avoid clicks."""
+    samples = array('h')
+    fade = int(rate * 0.005)
+    for frequency, seconds in notes:
+        length = int(rate * seconds)
+        step = 2 * math.pi * frequency / rate
+        for n in range(length):
+            envelope = min(1.0, n / fade, (length - n) / fade)
+            value = int(0.3 * 32767 * envelope * math.sin(step * n))
+            samples.extend([value] * channels)
+    return samples
+
+
+class SoundBoard:
+    """Sound effects held in memory and played on a fixed pool of mixer channels.
+    
+    Effects are decoded or synthesized once on a background thread, so play
+    never touches disk and never blocks; an effect requested before it is
+    ready is skipped. When every channel is busy the oldest voice is cut off.
+    Without pygame, with no audio device, or with TICTACTOE_AUDIO=off the
+    board is silent and play does nothing.
+    """
+    
+    def __init__(self, channels: int = SOUND_CHANNELS):
+        self.sounds = {}
+        self.channels = []
+        self.started: List[float] = []
+        if mixer is None or os.environ.get("TICTACTOE_AUDIO", "").lower() == "off":
+            return
+        try:
+            mixer.init(frequency=SOUND_RATE, size=-16, channels=1, buffer=512)
+        except Exception:
+            return  # No audio device: stay silent
+        mixer.set_num_channels(channels)
+        self.channels = [mixer.Channel(i) for i in range(channels)]
+        self.started = [0.0] * channels
+        threading.Thread(target=self.load, daemon=True).start()
+    
+    @property
+    def silent(self) -> bool:
+        """True when the silent backend is in use."""
+        return not self.channels
+    
+    def load(self):
+        """Decode or synthesize every effect into memory."""
+        rate, size, channels = mixer.get_init()
+        for name, notes in SOUND_EFFECTS.items():
+            try:
+                if os.path.exists(f"{name}.wav"):
+                    sound = mixer.Sound(f"{name}.wav")
+                elif size != -16:
+                    continue  # Synthesized samples are signed 16-bit
+                else:
+                    sound = mixer.Sound(buffer=synthesize_effect(notes, rate, channels).tobytes())
+            except Exception:
+                continue  # Leave this effect out rather than stop the others
+            self.sounds[name] = sound
+    
+    def play(self, name: str):
+        """Start an effect on a free channel, stealing the oldest voice if none is free."""
+        sound = self.sounds.get(name)
+        if sound is None:
+            return
+        voice = next((i for i, channel in enumerate(self.channels) if not channel.get_busy()), None)
+        if voice is None:
+            voice = min(range(len(self.channels)), key=self.started.__getitem__)
+        self.channels[voice].play(sound)
+        self.started[voice] = time.perf_counter()
 
 
 class TicTacToeApp:
@@ -18,9 +2123,11 @@ class TicTacToeApp:
         self.root.minsize(600, 700)
         self.root.configure(bg="#2c3e50")
         
-        # Initialize sound mixer
-        mixer.init()
-        self.load_sounds()
+        # Sound effects load in the background; play is a no-op until they are ready
+        self.sound_board = SoundBoard()
+        
+        # External engines are started on first use
+        self.engine_pool = None
         
         # Load game statistics
         self.stats_file = "tictactoe_stats.json"
@@ -32,7 +2139,10 @@ class TicTacToeApp:
             'header': font.Font(family='Helvetica', size=16, weight='bold'),
             'button': font.Font(family='Helvetica', size=14),
             'board': font.Font(family='Helvetica', size=36, weight='bold'),
-            'stats': font.Font(family='Helvetica', size=12)
+            'stats': font.Font(family='Helvetica', size=12),
+            'analysis': font.Font(family='Helvetica', size=10, weight='bold'),
+            'cell': font.Font(family='Helvetica', size=14, weight='bold'),
+            'stone': font.Font(family='Helvetica', size=9, weight='bold')
         }
         
         # Color scheme
@@ -52,35 +2162,19 @@ class TicTacToeApp:
         
         self.create_main_menu()
 
-    def load_sounds(self):
-        """Load sound effects (using placeholder sounds - replace with actual files)."""
-        self.sounds = {
-            'move': None,
-            'win': None,
-            'draw': None,
-            'click': None
-        }
-        try:
-            # Replace these with actual sound files if available
-            # self.sounds['move'] = mixer.Sound('move.wav')
-            # self.sounds['win'] = mixer.Sound('win.wav')
-            # self.sounds['draw'] = mixer.Sound('draw.wav')
-            # self.sounds['click'] = mixer.Sound('click.wav')
-            pass
-        except:
-            print("Sound files not found. Continuing without sound.")
-
     def play_sound(self, sound_name: str):
         """Play a sound effect if available."""
-        if sound_name in self.sounds and self.sounds[sound_name]:
-            self.sounds[sound_name].play()
+        self.sound_board.play(sound_name)
 
     def load_stats(self) -> Dict:
         """Load game statistics from file."""
         if os.path.exists(self.stats_file):
             try:
                 with open(self.stats_file, 'r') as f:
-                    return json.load(f)
+                    stats = json.load(f)
+                # Files written before per-variant results were kept
+                stats.setdefault('by_variant', {})
+                return stats
             except:
                 pass
         # Default stats
@@ -89,7 +2183,8 @@ class TicTacToeApp:
             'pvp_draws': 0,
             'ai_wins': {'Player': 0, 'AI': 0},
             'ai_draws': 0,
-            'total_games': 0
+            'total_games': 0,
+            'by_variant': {}
         }
 
     def save_stats(self):
@@ -97,28 +2192,39 @@ class TicTacToeApp:
         with open(self.stats_file, 'w') as f:
             json.dump(self.stats, f, indent=2)
 
-    def update_stats(self, mode: str, winner: Optional[str]):
-        """Update game statistics."""
+    def update_stats(self, mode: str, variant: str, winner: Optional[int]):
+        """Update game statistics; winner is the winning player's index."""
         self.stats['total_games'] += 1
         
         if mode == "pvp":
-            if winner:
-                self.stats['pvp_wins'][winner] += 1
+            if winner is not None:
+                self.stats['pvp_wins'][("Player 1", "Player 2")[winner]] += 1
             else:
                 self.stats['pvp_draws'] += 1
         else:  # ai mode
-            if winner:
-                self.stats['ai_wins'][winner] += 1
+            if winner is not None:
+                self.stats['ai_wins'][("Player", "AI")[winner]] += 1
             else:
                 self.stats['ai_draws'] += 1
         
+        # Win / draw / loss for the first player, per variant and mode
+        results = self.stats['by_variant'].setdefault(variant, {'pvp': [0, 0, 0], 'ai': [0, 0, 0]})
+        results[mode][1 if winner is None else 2 * winner] += 1
+        
         self.save_stats()
 
+    def format_frequencies(self, counts: Tuple[float, float, float]) -> str:
+        """Win / draw / loss counts as percentages."""
+        total = sum(counts)
+        if not total:
+            return "no games yet"
+        return " / ".join(f"{count / total:.1%}" for count in counts)
+
     def show_stats(self):
         """Show game statistics in a new window."""
         stats_window = tk.Toplevel(self.root)
         stats_window.title("Game Statistics")
-        stats_window.geometry("500x400")
+        stats_window.geometry("500x640")
         stats_window.configure(bg=self.colors['bg'])
         
         tk.Label(
@@ -187,6 +2293,46 @@ class TicTacToeApp:
             fg=self.colors['text']
         ).pack(anchor=tk.W)
         
+        # Outcome frequencies beside the whole game tree, all from X's side
+        tree_analytics = GameTreeAnalytics()
+        tree = tree_analytics.lookup([""] * 9)
+        freq_frame = tk.Frame(stats_window, bg=self.colors['bg'])
+        freq_frame.pack(fill=tk.X, padx=20, pady=10)
+        
+        tk.Label(
+            freq_frame,
+            text="Outcomes for X (win / draw / loss):",
+            font=self.fonts['header'],
+            bg=self.colors['bg'],
+            fg=self.colors['text']
+        ).pack(anchor=tk.W)
+        
+        value, _, perfect_games = tree['perfect']
+        # Only classic games are comparable with the 3x3 game tree
+        classic = self.stats['by_variant'].get("classic", {'pvp': [0, 0, 0], 'ai': [0, 0, 0]})
+        rows = [
+            ("Your classic games vs AI", classic['ai']),
+            ("Classic Player 1 vs Player 2", classic['pvp']),
+            (f"All {tree_analytics.games:,} possible games", tree['games']),
+            ("Random play", tree['random'])
+        ]
+        for label, counts in rows:
+            tk.Label(
+                freq_frame,
+                text=f"{label}: {self.format_frequencies(counts)}",
+                font=self.fonts['stats'],
+                bg=self.colors['bg'],
+                fg=self.colors['text']
+            ).pack(anchor=tk.W)
+        
+        tk.Label(
+            freq_frame,
+            text=f"Perfect play: always a {['loss', 'draw', 'win'][value + 1]} ({perfect_games:,} perfect games)",
+            font=self.fonts['stats'],
+            bg=self.colors['bg'],
+            fg=self.colors['text']
+        ).pack(anchor=tk.W)
+        
         # Total games
         tk.Label(
             stats_window,
@@ -225,6 +2371,26 @@ class TicTacToeApp:
             fg=self.colors['text']
         ).pack()
         
+        # Board variant selection
+        variant_frame = tk.Frame(self.root, bg=self.colors['bg'])
+        variant_frame.pack()
+        
+        tk.Label(
+            variant_frame,
+            text="Board:",
+            font=self.fonts['button'],
+            bg=self.colors['bg'],
+            fg=self.colors['text']
+        ).pack(side=tk.LEFT, padx=5)
+        
+        self.variant_choice = tk.StringVar(value=next(iter(GAME_VARIANTS)))
+        ttk.Combobox(
+            variant_frame,
+            textvariable=self.variant_choice,
+            values=list(GAME_VARIANTS),
+            state='readonly'
+        ).pack(side=tk.LEFT)
+        
         # Button frame
         button_frame = tk.Frame(self.root, bg=self.colors['bg'])
         button_frame.pack(pady=20)
@@ -233,6 +2399,7 @@ class TicTacToeApp:
         buttons = [
             ("Player vs Player", self.start_pvp_game),
             ("Player vs AI", self.start_ai_menu),
+            ("Puzzles", self.start_puzzle),
             ("Game Statistics", self.show_stats),
             ("Quit", self.root.quit)
         ]
@@ -260,16 +2427,18 @@ class TicTacToeApp:
     
     def start_pvp_game(self):
         """Start a player vs player game."""
+        game_class = GAME_VARIANTS[self.variant_choice.get()]
         game_window = tk.Toplevel(self.root)
-        game_window.title("Player vs Player")
-        game_window.geometry("550x700")
-        TicTacToeGame(
+        game_window.title(f"Player vs Player ({self.variant_choice.get()})")
+        game_window.geometry(game_class.window_size)
+        game_class(
             game_window, 
             mode="pvp", 
             colors=self.colors, 
             fonts=self.fonts, 
             stats=self.stats,
-            play_sound=self.play_sound
+            play_sound=self.play_sound,
+            stats_callback=self.update_stats
         )
     
     def start_ai_menu(self):
@@ -291,8 +2460,13 @@ class TicTacToeApp:
             ("Easy", "easy"),
             ("Medium", "medium"),
             ("Hard", "hard"),
-            ("Unbeatable", "unbeatable")
+            ("Unbeatable", "unbeatable"),
+            ("External engine", "engine")
         ]
+        # The learned policy only knows the classic board
+        classic = GAME_VARIANTS[self.variant_choice.get()].variant == "classic"
+        if classic:
+            difficulties.append(("Learned", "learned"))
         
         for text, difficulty in difficulties:
             btn = tk.Button(
@@ -305,6 +2479,21 @@ class TicTacToeApp:
             )
             btn.pack(pady=5, ipadx=10, ipady=5)
         
+        # Trained policy checkpoints set the strength of the learned AI
+        stem, ext = os.path.splitext(POLICY_FILE)
+        checkpoints = sorted(
+            (f for f in os.listdir('.') if f.startswith(stem) and f.endswith(ext)),
+            key=lambda f: (len(f), f)
+        )
+        self.policy_choice = tk.StringVar(value=POLICY_FILE)
+        if classic:
+            ttk.Combobox(
+                ai_menu,
+                textvariable=self.policy_choice,
+                values=checkpoints,
+                state='readonly'
+            ).pack(pady=5)
+        
         ai_menu.grab_set()
     
     def start_ai_game(self, difficulty: str = "medium", menu_window: Optional[tk.Toplevel] = None):
@@ -312,23 +2501,91 @@ class TicTacToeApp:
         if menu_window:
             menu_window.destroy()
         
+        policy_file = self.policy_choice.get() if hasattr(self, 'policy_choice') else POLICY_FILE
+        if difficulty == "learned":
+            try:
+                QPolicy(policy_file)
+            except (OSError, ValueError):
+                messagebox.showerror(
+                    "Error",
+                    "No trained policy found. Run: python main.py --train EPISODES",
+                    parent=self.root
+                )
+                return
+        
+        if difficulty == "engine" and self.engine_pool is None:
+            try:
+                self.engine_pool = EnginePool()
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to start engine: {str(e)}", parent=self.root)
+                return
+        
+        game_class = GAME_VARIANTS[self.variant_choice.get()]
         game_window = tk.Toplevel(self.root)
-        game_window.title(f"Player vs AI ({difficulty.capitalize()})")
-        game_window.geometry("550x700")
-        TicTacToeGame(
+        game_window.title(f"Player vs AI ({difficulty.capitalize()}, {self.variant_choice.get()})")
+        game_window.geometry(game_class.window_size)
+        game_class(
             game_window, 
             mode="ai", 
             colors=self.colors, 
             fonts=self.fonts, 
             stats=self.stats,
             play_sound=self.play_sound,
-            ai_difficulty=difficulty
+            ai_difficulty=difficulty,
+            policy_file=policy_file,
+            engine_pool=self.engine_pool,
+            stats_callback=self.update_stats
+        )
+
+
+    def start_puzzle(self):
+        """Ask for a puzzle ID and open it against the unbeatable AI."""
+        try:
+            puzzles = PuzzleFile(PUZZLE_FILE)
+        except (OSError, ValueError):
+            messagebox.showerror(
+                "Error",
+                "No puzzle file found. Run: python main.py --puzzles",
+                parent=self.root
+            )
+            return
+        if puzzles.size != 3 or puzzles.count == 0:
+            messagebox.showerror("Error", "The puzzle file has no 3x3 puzzles", parent=self.root)
+            return
+        
+        puzzle_id = simpledialog.askinteger(
+            "Puzzles",
+            f"Puzzle ID (0-{puzzles.count - 1}):",
+            minvalue=0,
+            maxvalue=puzzles.count - 1,
+            parent=self.root
+        )
+        if puzzle_id is None:
+            return
+        
+        game_window = tk.Toplevel(self.root)
+        game_window.geometry(TicTacToeGame.window_size)
+        game = TicTacToeGame(
+            game_window,
+            mode="ai",
+            colors=self.colors,
+            fonts=self.fonts,
+            stats=self.stats,
+            play_sound=self.play_sound,
+            ai_difficulty="unbeatable"
         )
+        game.load_puzzle(puzzle_id)
 
 
 class TicTacToeGame:
     """Tic-Tac-Toe game implementation with enhanced features."""
     
+    variant = "classic"
+    cell_count = 9
+    window_size = "550x700"
+    search_class = MoveSearch
+    supports_analysis = True
+    
     def __init__(
         self, 
         root: tk.Toplevel, 
@@ -337,7 +2594,10 @@ class TicTacToeGame:
         fonts: Dict, 
         stats: Dict,
         play_sound: callable,
-        ai_difficulty: str = "medium"
+        ai_difficulty: str = "medium",
+        policy_file: str = POLICY_FILE,
+        engine_pool: Optional[EnginePool] = None,
+        stats_callback: Optional[callable] = None
     ):
         self.root = root
         self.mode = mode
@@ -346,11 +2606,16 @@ class TicTacToeGame:
         self.stats = stats
         self.play_sound = play_sound
         self.ai_difficulty = ai_difficulty
+        self.policy_file = policy_file
+        self.policy = None
+        self.engine_pool = engine_pool
+        self.stats_callback = stats_callback
+        self.puzzle = None
         
         self.root.configure(bg=self.colors['bg'])
         
         # Game state
-        self.board = [""] * 9
+        self.board = [""] * self.cell_count
         self.current_player = 0
         self.winning_line = None
         self.game_over = False
@@ -367,8 +2632,15 @@ class TicTacToeGame:
         # Save/load functionality
         self.save_file = "tictactoe_save.json"
         
+        # Background analysis and pondering
+        self.analyzer = PositionAnalyzer() if self.supports_analysis else None
+        self.show_analysis = tk.BooleanVar(value=False)
+        self.root.bind("<Destroy>", self.on_destroy)
+        
         # UI elements
         self.create_widgets()
+        self.request_analysis()
+        self.poll_analysis()
         
         # Start move timer if it's a player's turn
         if not (self.mode == "ai" and self.current_player == 1):
@@ -428,28 +2700,21 @@ class TicTacToeGame:
             )
             self.difficulty_label.pack()
         
-        # Game board
-        self.board_frame = tk.Frame(self.root, bg=self.colors['grid'], padx=10, pady=10)
-        self.board_frame.pack(pady=20)
-        
-        # Create board buttons
-        self.buttons = []
-        for i in range(9):
-            btn = tk.Button(
-                self.board_frame,
-                text="",
-                font=self.fonts['board'],
-                width=3,
-                height=1,
-                bg=self.colors['board_bg'],
+        if self.supports_analysis:
+            tk.Checkbutton(
+                self.turn_frame,
+                text="Show analysis",
+                variable=self.show_analysis,
+                font=self.fonts['stats'],
+                bg=self.colors['bg'],
                 fg=self.colors['text'],
-                activebackground=self.colors['secondary'],
-                relief='flat',
-                borderwidth=0,
-                command=lambda idx=i: self.make_move(idx)
-            )
-            btn.grid(row=i // 3, column=i % 3, padx=5, pady=5, ipadx=10, ipady=10)
-            self.buttons.append(btn)
+                selectcolor=self.colors['board_bg'],
+                activebackground=self.colors['bg'],
+                command=self.request_analysis
+            ).pack()
+        
+        # Game board
+        self.create_board()
         
         # Control buttons
         self.control_frame = tk.Frame(self.root, bg=self.colors['bg'], padx=10, pady=10)
@@ -495,6 +2760,41 @@ class TicTacToeGame:
         )
         self.menu_btn.pack(side=tk.RIGHT, padx=5)
     
+    def create_board(self):
+        """Create the grid of board buttons."""
+        self.board_frame = tk.Frame(self.root, bg=self.colors['grid'], padx=10, pady=10)
+        self.board_frame.pack(pady=20)
+        
+        # Create board buttons
+        self.buttons = []
+        for i in range(9):
+            btn = tk.Button(
+                self.board_frame,
+                text="",
+                font=self.fonts['board'],
+                width=3,
+                height=1,
+                bg=self.colors['board_bg'],
+                fg=self.colors['text'],
+                activebackground=self.colors['secondary'],
+                relief='flat',
+                borderwidth=0,
+                command=lambda idx=i: self.make_move(idx)
+            )
+            btn.grid(row=i // 3, column=i % 3, padx=5, pady=5, ipadx=10, ipady=10)
+            self.buttons.append(btn)
+        
+        # Analysis overlay, one small label in the corner of each cell
+        self.analysis_labels = []
+        for i in range(9):
+            label = tk.Label(
+                self.board_frame,
+                font=self.fonts['analysis'],
+                bg=self.colors['board_bg']
+            )
+            label.bind("<Button-1>", lambda e, idx=i: self.make_move(idx))
+            self.analysis_labels.append(label)
+    
     def start_move_timer(self):
         """Start the timer for the current move."""
         if self.move_timer:
@@ -546,12 +2846,17 @@ class TicTacToeGame:
         
         # If in AI mode and game isn't over, let AI make a move
         if self.mode == "ai" and not self.game_over and self.current_player == 1:
-            self.root.after(500, self.ai_move)
+            # A pondered reply is ready, so answer without the thinking pause
+            pondered = self.analyzer and self.analyzer.cached_reply(self.board, self.ai_difficulty)
+            self.root.after(0 if pondered else 500, self.ai_move)
     
     def update_board(self, index: int):
         """Update the game board with a move."""
         player = self.players[self.current_player]
         self.board[index] = player["symbol"]
+        if self.analyzer:
+            self.analyzer.invalidate(self.board)
+        self.hide_analysis()
         
         # Update button appearance
         self.buttons[index].config(
@@ -570,14 +2875,8 @@ class TicTacToeGame:
     
     def check_win(self) -> bool:
         """Check if current player has won."""
-        win_patterns = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # columns
-            [0, 4, 8], [2, 4, 6]               # diagonals
-        ]
-        
         symbol = self.players[self.current_player]["symbol"]
-        for pattern in win_patterns:
+        for pattern in WIN_PATTERNS:
             if all(self.board[i] == symbol for i in pattern):
                 self.winning_line = pattern
                 return True
@@ -607,9 +2906,9 @@ class TicTacToeGame:
         # Play win sound
         self.play_sound('win')
         
-        # Update statistics
-        if hasattr(self, 'stats_callback'):
-            self.stats_callback(self.mode, player['name'])
+        # Update statistics; puzzles start mid-game and are not counted
+        if self.stats_callback and self.puzzle is None:
+            self.stats_callback(self.mode, self.variant, self.current_player)
         
         # Show win message
         messagebox.showinfo(
@@ -646,8 +2945,8 @@ class TicTacToeGame:
         self.play_sound('draw')
         
         # Update statistics
-        if hasattr(self, 'stats_callback'):
-            self.stats_callback(self.mode, None)
+        if self.stats_callback and self.puzzle is None:
+            self.stats_callback(self.mode, self.variant, None)
         
         messagebox.showinfo("Game Over", "The game is a draw!", parent=self.root)
     
@@ -667,6 +2966,8 @@ class TicTacToeGame:
         else:
             if self.move_timer:
                 self.root.after_cancel(self.move_timer)
+        
+        self.request_analysis()
     
     def ai_move(self):
         """Make a move for the AI player based on difficulty level."""
@@ -677,121 +2978,125 @@ class TicTacToeGame:
         if not empty_cells:
             return
             
-        if self.ai_difficulty == "easy":
-            # Random moves
-            move = random.choice(empty_cells)
-        elif self.ai_difficulty == "medium":
-            # Sometimes blocks or wins, sometimes random
-            if random.random() < 0.7:  # 70% chance to make a smart move
-                move = self.find_smart_move()
-            else:
-                move = random.choice(empty_cells)
-        elif self.ai_difficulty == "hard":
-            # Always blocks or wins if possible, otherwise random
-            move = self.find_smart_move()
-        else:  # unbeatable
-            # Uses minimax algorithm for perfect play
-            move = self.find_best_move()
+        if self.ai_difficulty == "learned":
+            move = self.find_learned_move()
+        elif self.ai_difficulty == "engine":
+            move = self.find_engine_move()
+        else:
+            # Every level is a budgeted search: bounded nodes and time, plus noise
+            move = self.find_budgeted_move()
         
         self.play_sound('move')
         self.update_board(move)
     
-    def find_smart_move(self) -> int:
-        """Find a smart move (win if possible, block if needed, otherwise random)."""
-        # Check for winning move
-        for i in [i for i, cell in enumerate(self.board) if cell == ""]:
-            self.board[i] = self.players[1]["symbol"]
-            if self.check_win():
-                self.board[i] = ""
-                return i
-            self.board[i] = ""
-        
-        # Check for blocking move
-        for i in [i for i, cell in enumerate(self.board) if cell == ""]:
-            self.board[i] = self.players[0]["symbol"]
-            if self.check_win():
-                self.board[i] = ""
-                return i
-            self.board[i] = ""
-        
-        # If center is available, take it
-        if self.board[4] == "":
-            return 4
-        
-        # Otherwise random
-        empty_cells = [i for i, cell in enumerate(self.board) if cell == ""]
-        return random.choice(empty_cells)
+    def find_budgeted_move(self, difficulty: Optional[str] = None, time_budget: Optional[float] = None) -> int:
+        """Find a move with the search budget of the given or current difficulty."""
+        difficulty = difficulty or self.ai_difficulty
+        search = self.search_class.for_level(difficulty)
+        if time_budget is not None:
+            search.time_budget = min(search.time_budget, time_budget)
+        pondered = self.analyzer and self.analyzer.cached_reply(self.board, difficulty)
+        if pondered:
+            return search.select(pondered)
+        symbol, opponent = self.players[1]["symbol"], self.players[0]["symbol"]
+        return search.select(search.search(self.board, symbol, opponent, *self.search_args()))
     
-    def find_best_move(self) -> int:
-        """Find the best move using minimax algorithm."""
-        best_score = -float('inf')
-        best_move = None
-        
-        for i in range(9):
-            if self.board[i] == "":
-                self.board[i] = self.players[1]["symbol"]
-                score = self.minimax(self.board, 0, False)
-                self.board[i] = ""
-                
-                if score > best_score:
-                    best_score = score
-                    best_move = i
-        
-        return best_move if best_move is not None else random.choice(
-            [i for i, cell in enumerate(self.board) if cell == ""]
-        )
+    def search_args(self) -> Tuple:
+        """Extra position arguments a board variant passes to its search."""
+        return ()
     
-    def minimax(self, board: List[str], depth: int, is_maximizing: bool) -> int:
-        """Minimax algorithm for AI decision making."""
-        # Evaluate the current board state
-        result = self.evaluate_board(board)
-        if result is not None:
-            return result
-        
-        if is_maximizing:
-            best_score = -float('inf')
-            for i in range(9):
-                if board[i] == "":
-                    board[i] = self.players[1]["symbol"]
-                    score = self.minimax(board, depth + 1, False)
-                    board[i] = ""
-                    best_score = max(score, best_score)
-            return best_score
-        else:
-            best_score = float('inf')
-            for i in range(9):
-                if board[i] == "":
-                    board[i] = self.players[0]["symbol"]
-                    score = self.minimax(board, depth + 1, True)
-                    board[i] = ""
-                    best_score = min(score, best_score)
-            return best_score
-    
-    def evaluate_board(self, board: List[str]) -> Optional[int]:
-        """Evaluate the board state for minimax."""
-        win_patterns = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],
-            [0, 4, 8], [2, 4, 6]
-        ]
+    def find_engine_move(self) -> int:
+        """Ask the external engine pool for a move, falling back to the built-in search."""
+        cells = "".join(cell or "." for cell in self.board)
+        options = "".join(f" {key} {value}" for key, value in self.engine_options().items())
+        position = f"position {self.variant} {cells} {self.players[1]['symbol']}{options}"
+        
+        started = time.perf_counter()
+        limit = self.search_class.response_time
+        if self.engine_pool is not None:
+            try:
+                move, _ = self.engine_pool.best_move(position, limit * ENGINE_DEADLINE_SHARE)
+                if move is not None and self.is_legal(move):
+                    return move
+            except EngineError:
+                pass
+        # Fall back to a small node budget in whatever is left of the move's time limit
+        return self.find_budgeted_move("hard", max(0.0, limit - (time.perf_counter() - started)))
+    
+    def engine_options(self) -> Dict:
+        """Extra position options a board variant sends to external engines."""
+        return {}
+    
+    def is_legal(self, index: int) -> bool:
+        """Check whether index is a playable cell."""
+        return 0 <= index < self.cell_count and self.board[index] == ""
+    
+    def find_learned_move(self) -> int:
+        """Find a move with a single lookup in the trained policy table."""
+        if self.policy is None:
+            self.policy = QPolicy(self.policy_file)
+        return self.policy.best_move(self.board)
+    
+    def request_analysis(self):
+        """Ask the background analyzer about the current position."""
+        self.hide_analysis()
+        if self.analyzer is None:
+            return
         
-        # Check for wins
-        for pattern in win_patterns:
-            if board[pattern[0]] != "" and all(board[i] == board[pattern[0]] for i in pattern):
-                if board[pattern[0]] == self.players[1]["symbol"]:
-                    return 10  # AI wins
-                else:
-                    return -10  # Player wins
+        ponder = None
+        # Only the built-in search levels can use a pondered reply
+        if self.mode == "ai" and self.current_player == 0 and self.ai_difficulty in AI_LEVELS:
+            ponder = (self.players[1]["symbol"], self.ai_difficulty)
+        if not self.game_over and (ponder or self.show_analysis.get()):
+            self.analyzer.request(self.board, self.players[self.current_player]["symbol"], ponder)
+        else:
+            # Stop pondering so it does not compete with the AI's own search
+            self.analyzer.cancel()
+    
+    def poll_analysis(self):
+        """Show finished analysis for the current position without blocking Tk."""
+        if self.analyzer is None or not self.root.winfo_exists():
+            return
         
-        # Check for draw
-        if all(cell != "" for cell in board):
-            return 0  # Draw
+        while not self.analyzer.results.empty():
+            cells, symbol, evaluation = self.analyzer.results.get_nowait()
+            current = self.players[self.current_player]["symbol"]
+            if (self.show_analysis.get() and not self.game_over
+                    and cells == tuple(self.board) and symbol == current):
+                self.draw_analysis(evaluation)
         
-        return None  # Game not over
+        self.root.after(100, self.poll_analysis)
+    
+    def draw_analysis(self, evaluation: Dict[int, Tuple[int, int]]):
+        """Label each empty cell with its outcome (W/D/L) and distance in plies."""
+        for i, (value, distance) in evaluation.items():
+            if value > 0:
+                text, color = f"W{distance}", self.colors['win']
+            elif value < 0:
+                text, color = f"L{distance}", self.colors['accent']
+            else:
+                text, color = "D", self.colors['text']
+            label = self.analysis_labels[i]
+            label.config(text=text, fg=color)
+            label.place(in_=self.buttons[i], relx=1.0, rely=1.0, x=-2, y=-2, anchor='se')
+    
+    def hide_analysis(self):
+        """Remove the analysis overlay from the board."""
+        for label in self.analysis_labels:
+            label.place_forget()
+    
+    def variant_state(self) -> Dict:
+        """Extra state a board variant needs saved alongside the cells."""
+        return {}
+    
+    def restore_variant_state(self, game_state: Dict):
+        """Restore the extra state saved by variant_state."""
+        pass
     
     def save_game(self):
         """Save the current game state to a file."""
         game_state = {
+            'variant': self.variant,
             'mode': self.mode,
             'board': self.board,
             'current_player': self.current_player,
@@ -801,6 +3106,7 @@ class TicTacToeGame:
             'ai_difficulty': self.ai_difficulty,
             'move_start_time': time.time() - self.move_start_time if self.move_start_time else 0
         }
+        game_state.update(self.variant_state())
         
         try:
             with open(self.save_file, 'w') as f:
@@ -822,6 +3128,8 @@ class TicTacToeGame:
             # Validate loaded game state
             if not all(key in game_state for key in ['mode', 'board', 'current_player', 'players']):
                 raise ValueError("Invalid game save file")
+            if game_state.get('variant', 'classic') != self.variant:
+                raise ValueError("Saved game is for a different board")
             
             # Update game state
             self.mode = game_state['mode']
@@ -831,6 +3139,7 @@ class TicTacToeGame:
             self.game_over = game_state.get('game_over', False)
             self.winning_line = game_state.get('winning_line')
             self.ai_difficulty = game_state.get('ai_difficulty', 'medium')
+            self.restore_variant_state(game_state)
             
             # Update UI
             self.reset_ui()
@@ -853,7 +3162,7 @@ class TicTacToeGame:
     def reset_ui(self):
         """Reset the UI based on current game state."""
         # Update board buttons
-        for i in range(9):
+        for i in range(self.cell_count):
             if self.board[i] == "":
                 self.buttons[i].config(text="", state=tk.NORMAL, bg=self.colors['board_bg'])
             else:
@@ -887,10 +3196,32 @@ class TicTacToeGame:
         # Highlight winning line if game is over
         if self.game_over and self.winning_line:
             self.highlight_winning_line()
+        
+        if self.analyzer:
+            self.analyzer.invalidate(self.board)
+        self.request_analysis()
+    
+    def load_puzzle(self, puzzle_id: int, path: str = PUZZLE_FILE):
+        """Set up a puzzle by ID, with the human playing the side to move."""
+        self.puzzle = PuzzleFile(path).get(puzzle_id)
+        self.board = list(self.puzzle['board'])
+        self.players[0]['symbol'] = self.puzzle['symbol']
+        self.players[1]['symbol'] = "O" if self.puzzle['symbol'] == "X" else "X"
+        self.current_player = 0
+        self.game_over = False
+        self.winning_line = None
+        
+        self.root.title(f"Puzzle #{puzzle_id}: {self.puzzle['symbol']} to win in {self.puzzle['moves']}")
+        self.reset_ui()
+        self.start_move_timer()
     
     def reset_game(self):
         """Reset the game to its initial state."""
-        self.board = [""] * 9
+        if self.puzzle is not None:
+            self.load_puzzle(self.puzzle['id'])  # Retry the puzzle
+            return
+        
+        self.board = [""] * self.cell_count
         self.winning_line = None
         self.game_over = False
         self.current_player = 0
@@ -913,6 +3244,9 @@ class TicTacToeGame:
         
         # Reset timer
         self.start_move_timer()
+        if self.analyzer:
+            self.analyzer.invalidate(self.board)
+        self.request_analysis()
         
         # If AI's turn first
         if self.mode == "ai" and self.current_player == 1:
@@ -920,12 +3254,324 @@ class TicTacToeGame:
     
     def return_to_menu(self):
         """Return to the main menu."""
+        self.root.destroy()
+    
+    def on_destroy(self, event: tk.Event):
+        """Stop the timer and analyzer thread however the window is closed."""
+        if event.widget is not self.root:
+            return  # The binding also fires for every child widget
         if self.move_timer:
             self.root.after_cancel(self.move_timer)
-        self.root.destroy()
+        if self.analyzer:
+            self.analyzer.stop()
+
+
+class QubicGame(TicTacToeGame):
+    """3D tic-tac-toe on a 4x4x4 cube, shown as four 4x4 layers."""
+    
+    variant = "qubic"
+    cell_count = 64
+    window_size = "700x820"
+    search_class = QubicSearch
+    supports_analysis = False
+    
+    def create_board(self):
+        """Create four 4x4 layers of board buttons in a 2x2 arrangement."""
+        self.board_frame = tk.Frame(self.root, bg=self.colors['bg'])
+        self.board_frame.pack(pady=10)
+        
+        self.buttons = []
+        for layer in range(4):
+            layer_frame = tk.Frame(self.board_frame, bg=self.colors['grid'], padx=4, pady=4)
+            layer_frame.grid(row=layer // 2, column=layer % 2, padx=10, pady=10)
+            
+            tk.Label(
+                layer_frame,
+                text=f"Layer {layer + 1}",
+                font=self.fonts['stats'],
+                bg=self.colors['grid'],
+                fg=self.colors['text']
+            ).grid(row=0, column=0, columnspan=4)
+            
+            for cell in range(16):
+                index = layer * 16 + cell
+                btn = tk.Button(
+                    layer_frame,
+                    text="",
+                    font=self.fonts['cell'],
+                    width=2,
+                    height=1,
+                    bg=self.colors['board_bg'],
+                    fg=self.colors['text'],
+                    activebackground=self.colors['secondary'],
+                    relief='flat',
+                    borderwidth=0,
+                    command=lambda idx=index: self.make_move(idx)
+                )
+                btn.grid(row=1 + cell // 4, column=cell % 4, padx=2, pady=2, ipadx=4, ipady=4)
+                self.buttons.append(btn)
+        
+        self.analysis_labels = []
+    
+    def check_win(self) -> bool:
+        """Check if current player has completed one of the 76 lines."""
+        symbol = self.players[self.current_player]["symbol"]
+        bits = sum(1 << i for i, cell in enumerate(self.board) if cell == symbol)
+        for line, mask in zip(QUBIC_LINES, QUBIC_MASKS):
+            if bits & mask == mask:
+                self.winning_line = line
+                return True
+        return False
+
+
+class UltimateGame(TicTacToeGame):
+    """Ultimate tic-tac-toe: nine local boards, the cell played picks the next board."""
+    
+    variant = "ultimate"
+    cell_count = 81
+    window_size = "640x840"
+    search_class = UltimateSearch
+    supports_analysis = False
+    
+    def __init__(self, *args, **kwargs):
+        self.state = UltimateState()
+        super().__init__(*args, **kwargs)
+        self.refresh_boards()
+    
+    def create_board(self):
+        """Create a 3x3 grid of local 3x3 boards."""
+        self.board_frame = tk.Frame(self.root, bg=self.colors['grid'], padx=6, pady=6)
+        self.board_frame.pack(pady=10)
+        
+        self.buttons = []
+        self.local_frames = []
+        for b in range(9):
+            local_frame = tk.Frame(self.board_frame, bg=self.colors['board_bg'], padx=3, pady=3)
+            local_frame.grid(row=b // 3, column=b % 3, padx=4, pady=4)
+            self.local_frames.append(local_frame)
+            
+            for c in range(9):
+                btn = tk.Button(
+                    local_frame,
+                    text="",
+                    font=self.fonts['cell'],
+                    width=2,
+                    height=1,
+                    bg=self.colors['board_bg'],
+                    fg=self.colors['text'],
+                    activebackground=self.colors['secondary'],
+                    relief='flat',
+                    borderwidth=0,
+                    command=lambda idx=b * 9 + c: self.make_move(idx)
+                )
+                btn.grid(row=c // 3, column=c % 3, padx=1, pady=1, ipadx=2, ipady=2)
+                self.buttons.append(btn)
+        
+        self.analysis_labels = []
+    
+    def refresh_boards(self):
+        """Color won local boards and highlight the ones open for the next move."""
+        playable = set() if self.game_over else {move // 9 for move in self.state.legal_moves()}
+        for b, local_frame in enumerate(self.local_frames):
+            status = self.state.status[b]
+            if status in ("X", "O"):
+                color = next(p['color'] for p in self.players if p['symbol'] == status)
+            elif b in playable:
+                color = self.colors['primary']
+            else:
+                color = self.colors['board_bg']
+            local_frame.config(bg=color)
+    
+    def is_legal(self, index: int) -> bool:
+        """Check whether index is allowed by the active-board rule."""
+        return index in self.state.legal_moves()
+    
+    def engine_options(self) -> Dict:
+        """Tell external engines which local board is active."""
+        return {} if self.state.active is None else {'active': self.state.active}
+    
+    def make_move(self, index: int):
+        """Handle a player's move, enforcing the active-board rule."""
+        if not self.game_over and not self.is_legal(index):
+            self.play_sound('click')
+            return
+        super().make_move(index)
+    
+    def update_board(self, index: int):
+        """Update the incremental state, then the board widgets."""
+        self.state.play(index, self.players[self.current_player]["symbol"])
+        super().update_board(index)
+        self.refresh_boards()
+    
+    def check_win(self) -> bool:
+        """Check if current player has won three local boards in a row."""
+        symbol = self.players[self.current_player]["symbol"]
+        if self.state.winner != symbol:
+            return False
+        meta = self.state.meta[symbol]
+        line = next(p for p in WIN_PATTERNS if all(meta >> b & 1 for b in p))
+        self.winning_line = [b * 9 + c for b in line for c in range(9)]
+        return True
+    
+    def check_draw(self) -> bool:
+        """Check if every local board is decided without a winner."""
+        return not self.state.winner and not self.state.legal_moves()
+    
+    def search_args(self) -> Tuple:
+        """Tell the search which local board is active."""
+        return (self.state.active,)
+    
+    def variant_state(self) -> Dict:
+        """Save which local board the next move must be played in."""
+        return {'active_board': self.state.active}
+    
+    def restore_variant_state(self, game_state: Dict):
+        """Rebuild the incremental state from the loaded cells."""
+        self.state = UltimateState.from_cells(self.board, game_state.get('active_board'))
+    
+    def reset_ui(self):
+        """Reset the UI based on current game state."""
+        super().reset_ui()
+        self.refresh_boards()
+    
+    def reset_game(self):
+        """Reset the game to its initial state."""
+        self.state = UltimateState()
+        super().reset_game()
+        self.refresh_boards()
+
+
+class GomokuGame(TicTacToeGame):
+    """Gomoku: five in a row on a 15x15 board."""
+    
+    variant = "gomoku"
+    cell_count = GOMOKU_CELLS
+    window_size = "640x820"
+    search_class = GomokuSearch
+    supports_analysis = False
+    
+    def __init__(self, *args, **kwargs):
+        self.last_move = None
+        self.patterns = GomokuIndex()
+        super().__init__(*args, **kwargs)
+    
+    def create_board(self):
+        """Create the 15x15 grid of board buttons."""
+        self.board_frame = tk.Frame(self.root, bg=self.colors['grid'], padx=4, pady=4)
+        self.board_frame.pack(pady=10)
+        
+        self.buttons = []
+        for i in range(GOMOKU_CELLS):
+            btn = tk.Button(
+                self.board_frame,
+                text="",
+                font=self.fonts['stone'],
+                width=2,
+                height=1,
+                bg=self.colors['board_bg'],
+                fg=self.colors['text'],
+                activebackground=self.colors['secondary'],
+                relief='flat',
+                borderwidth=0,
+                command=lambda idx=i: self.make_move(idx)
+            )
+            btn.grid(row=i // GOMOKU_SIZE, column=i % GOMOKU_SIZE, padx=1, pady=1)
+            self.buttons.append(btn)
+        
+        self.analysis_labels = []
+    
+    def update_board(self, index: int):
+        """Update the pattern index along the lines through the move, then the widgets."""
+        self.last_move = index
+        self.patterns.play(index, GOMOKU_SIDES[self.players[self.current_player]["symbol"]])
+        super().update_board(index)
+    
+    def check_win(self) -> bool:
+        """Check the five-cell windows through the last move."""
+        if self.last_move is None:
+            return False
+        side = GOMOKU_SIDES[self.players[self.current_player]["symbol"]]
+        for n in GOMOKU_CELL_WINDOWS[self.last_move]:
+            if self.patterns.counts[side][n] == 5:
+                self.winning_line = GOMOKU_WINDOWS[n]
+                return True
+        return False
+    
+    def search_args(self) -> Tuple:
+        """Give the search the game's pattern index rather than rebuilding it."""
+        return (self.patterns,)
+    
+    def restore_variant_state(self, game_state: Dict):
+        """Rebuild the pattern index from the loaded cells."""
+        self.patterns = GomokuIndex.from_cells(self.board)
+        self.last_move = None
+    
+    def reset_game(self):
+        """Reset the game to its initial state."""
+        self.last_move = None
+        self.patterns = GomokuIndex()
+        super().reset_game()
+
+
+GAME_VARIANTS = {
+    "Classic 3x3": TicTacToeGame,
+    "Qubic 4x4x4": QubicGame,
+    "Ultimate": UltimateGame,
+    "Gomoku 15x15": GomokuGame
+}
 
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = TicTacToeApp(root)
-    root.mainloop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Tic-Tac-Toe Ultimate")
+    parser.add_argument('--train', type=int, metavar='EPISODES',
+                        help="train the learned AI by self-play instead of starting the GUI")
+    parser.add_argument('--policy', default=POLICY_FILE, help="policy file to write")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--checkpoint-every', type=int, default=None, metavar='EPISODES',
+                        help="write a checkpoint every N episodes")
+    parser.add_argument('--engine', action='store_true',
+                        help="run as an external engine on stdin/stdout")
+    parser.add_argument('--puzzles', action='store_true',
+                        help="generate forced-win puzzles (resumes an interrupted run)")
+    parser.add_argument('--board', default="3x3", choices=list(PUZZLE_BOARDS), help="puzzle board")
+    parser.add_argument('--moves', type=int, nargs='+', default=[2, 3],
+                        help="forced-win lengths to keep, in the solver's own moves")
+    parser.add_argument('--puzzle-file', default=PUZZLE_FILE, help="puzzle file to write")
+    parser.add_argument('--batch', nargs='?', const='-', metavar='FILE',
+                        help="analyze positions from FILE (or stdin) and print JSON lines, no GUI")
+    parser.add_argument('--variant', default="classic", choices=list(VARIANT_CELLS),
+                        help="board variant for --batch")
+    parser.add_argument('--level', default="unbeatable", choices=list(AI_LEVELS),
+                        help="AI level for --batch")
+    parser.add_argument('--analytics', nargs='?', const=ANALYTICS_FILE, metavar='FILE',
+                        help="count the whole game tree (cached in FILE) and print per-position outcomes")
+    parser.add_argument('--search-workers', type=int, default=0, metavar='N',
+                        help="split unbeatable searches across N processes (GUI and --engine)")
+    args = parser.parse_args()
+    
+    if args.search_workers > 1 and not (args.train or args.puzzles or args.batch or args.analytics):
+        MoveSearch.parallel_workers = args.search_workers
+        # Start the workers now, before Tk and the mixer exist in this process
+        search_pool(args.search_workers)
+    
+    if args.train:
+        train_policy(args.train, args.policy, args.workers, checkpoint_every=args.checkpoint_every)
+    elif args.puzzles:
+        generate_puzzles(args.board, args.moves, args.puzzle_file, args.workers)
+    elif args.analytics:
+        print_analytics(args.analytics)
+    elif args.engine:
+        run_engine()
+    elif args.batch:
+        if args.batch == '-':
+            run_batch(sys.stdin, args.variant, args.level, args.workers)
+        else:
+            with open(args.batch, 'r') as f:
+                run_batch(f, args.variant, args.level, args.workers)
+    else:
+        root = tk.Tk()
+        app = TicTacToeApp(root)
+        root.mainloop()
+        if app.engine_pool is not None:
+            app.engine_pool.close()
+    shutdown_search_pool()
\ No newline at end of file
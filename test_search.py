@@ -0,0 +1,77 @@
+import random
+import time
+import unittest
+
+import main
+
+
+def random_position(cells: int, stones: int, rng: random.Random) -> list:
+    """A board with stones placed alternately, X first, on random cells."""
+    board = [""] * cells
+    for k in range(stones):
+        board[rng.choice([i for i, cell in enumerate(board) if cell == ""])] = "XO"[k % 2]
+    return board
+
+
+class SplitSearchTest(unittest.TestCase):
+    """The root-split search picks the serial search's move at a fixed depth."""
+
+    workers = 2
+
+    @classmethod
+    def setUpClass(cls):
+        main.search_pool(cls.workers)
+
+    @classmethod
+    def tearDownClass(cls):
+        main.shutdown_search_pool()
+
+    def assert_same_move(self, search_class, board, depths, *extra):
+        symbol, opponent = ("X", "O") if board.count("X") == board.count("O") else ("O", "X")
+        serial, split = search_class(), search_class()
+        split.parallel_workers = self.workers
+        for search in (serial, split):
+            search.prepare(board, symbol, opponent, *extra)
+            search.deadline = time.perf_counter() + 60
+        moves = serial.root_moves()
+        if serial.scores or len(moves) < 2:
+            return  # Decided without searching
+        task = (search_class, list(board), symbol, opponent, extra)
+        for depth in depths:
+            serial_scores, split_scores = {}, {}
+            serial.serial_iteration(moves, depth, False, serial_scores)
+            split.split_iteration(task, moves, depth, False, split_scores)
+            best = max(serial_scores, key=serial_scores.get)
+            self.assertEqual(max(split_scores, key=split_scores.get), best, (board, depth))
+            self.assertEqual(split_scores[best], serial_scores[best], (board, depth))
+            # Exact scores must agree for every move
+            serial_scores, split_scores = {}, {}
+            serial.serial_iteration(moves, depth, True, serial_scores)
+            split.split_iteration(task, moves, depth, True, split_scores)
+            self.assertEqual(split_scores, serial_scores, (board, depth))
+
+    def test_classic(self):
+        rng = random.Random(1)
+        self.assert_same_move(main.MoveSearch, [""] * 9, [1, 2, 3, 4, 9])
+        for _ in range(10):
+            # Too few stones for a finished game
+            board = random_position(9, rng.randint(1, 4), rng)
+            self.assert_same_move(main.MoveSearch, board, [1, 2, 3, 4])
+
+    def test_qubic(self):
+        rng = random.Random(2)
+        for _ in range(3):
+            board = random_position(64, rng.randint(4, 10), rng)
+            self.assert_same_move(main.QubicSearch, board, [1, 2, 3])
+
+    def test_ultimate(self):
+        rng = random.Random(3)
+        for _ in range(3):
+            state = main.UltimateState.from_cells([""] * 81, None)
+            for k in range(rng.randint(2, 8)):
+                state.play(rng.choice(state.legal_moves()), "XO"[k % 2])
+            self.assert_same_move(main.UltimateSearch, list(state.cells), [1, 2, 3, 4], state.active)
+
+
+if __name__ == "__main__":
+    unittest.main()